@@ -0,0 +1,339 @@
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+
+from flask import g, jsonify, request
+
+from metrics import metrics
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADMISSION_DIR = os.path.join(tempfile.gettempdir(), 'benpdf-admission')
+
+POLL_INTERVAL = 0.01
+
+
+class CostClass:
+    def __init__(self, name, capacity, max_queue, max_wait):
+        self.name = name
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+    @property
+    def limited(self):
+        return self.capacity > 0
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class _FileSlots:
+    """A pool of ``count`` slots shared by every process on the host.
+
+    Each slot is a lock file; holding an flock on it means owning the slot.
+    The kernel drops the lock when the holder exits, so a crashed worker
+    never leaks capacity. The holder also writes its pid into the file, so
+    ``in_use`` can count slots without touching the locks, and a status
+    probe never makes a slot look busy to a request trying to take it.
+    """
+
+    def __init__(self, directory, name, count):
+        self.paths = [os.path.join(directory, f"{name}.{i}.lock") for i in range(count)]
+        for path in self.paths:
+            open(path, 'a').close()
+
+    def try_acquire(self, n):
+        held = []
+        for path in self.paths:
+            f = open(path, 'a')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                continue
+            os.ftruncate(f.fileno(), 0)
+            f.write(str(os.getpid()))
+            f.flush()
+            held.append(f)
+            if len(held) == n:
+                return held
+        self.release(held)
+        return None
+
+    @staticmethod
+    def release(held):
+        for f in held:
+            try:
+                os.ftruncate(f.fileno(), 0)
+                fcntl.flock(f, fcntl.LOCK_UN)
+            finally:
+                f.close()
+
+    def in_use(self):
+        used = 0
+        for path in self.paths:
+            try:
+                with open(path) as f:
+                    holder = f.read().strip()
+            except OSError:
+                continue
+            # A worker that died holding the slot left its pid behind, but
+            # the kernel already released its lock.
+            if holder.isdigit() and _pid_alive(int(holder)):
+                used += 1
+        return used
+
+
+class _LocalSlots:
+    """Per-process fallback for platforms without ``fcntl``."""
+
+    def __init__(self, directory, name, count):
+        self.count = count
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, n):
+        with self._lock:
+            if self.used + n > self.count:
+                return None
+            self.used += n
+            return [n]
+
+    def release(self, held):
+        with self._lock:
+            self.used -= sum(held)
+
+    def in_use(self):
+        return self.used
+
+
+class AdmissionController:
+    """Concurrency limits per cost class, with a short bounded queue.
+
+    Views declare their class with ``@admission.cost('cpu', weight=2)``;
+    undecorated views are 'light' and never limited, so cheap calls and
+    ``/healthz`` keep answering while heavy work is saturated. A view can
+    also cap its own concurrency with ``limit=``, on top of its class, so
+    one slow tool can't take every slot of a class it shares. A request
+    that finds its class full waits in the queue for up to ``max_wait``
+    seconds; if the queue is also full, or the wait runs out, it gets a 429
+    with ``Retry-After``. Slots are lock files, so limits hold across all
+    gunicorn workers on the host.
+
+    ``endpoint_limits`` maps endpoint names to limits and overrides the
+    ones given to ``cost``.
+    """
+
+    def __init__(self, classes, directory=None, endpoint_limits=None):
+        self.directory = directory or os.environ.get('ADMISSION_DIR', DEFAULT_ADMISSION_DIR)
+        os.makedirs(self.directory, exist_ok=True)
+        self.slot_type = _FileSlots if fcntl is not None else _LocalSlots
+        self.classes = {c.name: c for c in classes}
+        self.slots = {}
+        self.queues = {}
+        for c in classes:
+            if c.limited:
+                self.slots[c.name] = self.slot_type(self.directory, c.name, c.capacity)
+                self.queues[c.name] = self.slot_type(self.directory, f"{c.name}-queue", max(c.max_queue, 0))
+        self.endpoint_limits = dict(endpoint_limits or {})
+        self.endpoint_slots = {}
+        self._endpoint_lock = threading.Lock()
+
+    @staticmethod
+    def cost(class_name, weight=1, limit=None):
+        """Mark a view as belonging to ``class_name``, taking ``weight`` slots.
+
+        ``class_name`` may also be a callable returning ``(class_name, weight)``
+        for views whose cost depends on the request; it is called before the
+        view runs, inside the request context. ``limit`` caps how many
+        requests to this view run at once across the host.
+        """
+        def decorator(view):
+            view.admission_cost = class_name if callable(class_name) else (class_name, weight)
+            view.admission_limit = limit
+            return view
+        return decorator
+
+    def _slots_for_endpoint(self, endpoint, view):
+        limit = self.endpoint_limits.get(endpoint, getattr(view, 'admission_limit', None))
+        if not limit or limit <= 0:
+            return None
+        with self._endpoint_lock:
+            entry = self.endpoint_slots.get(endpoint)
+            if entry is None or entry[0] != limit:
+                entry = self.endpoint_slots[endpoint] = (limit, self.slot_type(self.directory, f"endpoint-{endpoint}", limit))
+            return entry[1]
+
+    @staticmethod
+    def _try_acquire(pools):
+        """Take ``n`` slots from each ``(slots, n)`` pool, or none at all."""
+        taken = []
+        for slots, n in pools:
+            held = slots.try_acquire(n)
+            if held is None:
+                for s, h in taken:
+                    s.release(h)
+                return None
+            taken.append((slots, held))
+        return taken
+
+    def _reject(self, cost_class, reason):
+        logger.warning("Rejecting %s (%s class): %s", request.path, cost_class.name, reason)
+        retry_after = max(1, math.ceil(cost_class.max_wait))
+        response = jsonify({'error': f'Server is busy ({cost_class.name} work). Please retry shortly.'})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+
+    def admit(self, view, endpoint=None):
+        cost = getattr(view, 'admission_cost', ('light', 1))
+        class_name, weight = cost() if callable(cost) else cost
+        cost_class = self.classes.get(class_name)
+        if cost_class is None or not cost_class.limited:
+            return None
+        pools = []
+        endpoint_slots = self._slots_for_endpoint(endpoint, view) if endpoint else None
+        if endpoint_slots is not None:
+            pools.append((endpoint_slots, 1))
+        pools.append((self.slots[class_name], min(weight, cost_class.capacity)))
+
+        held = self._try_acquire(pools)
+        if held is None:
+            ticket = self.queues[class_name].try_acquire(1) if cost_class.max_queue > 0 else None
+            if ticket is None:
+                return self._reject(cost_class, 'queue full')
+            try:
+                deadline = time.monotonic() + cost_class.max_wait
+                while held is None and time.monotonic() < deadline:
+                    time.sleep(POLL_INTERVAL)
+                    held = self._try_acquire(pools)
+            finally:
+                self.queues[class_name].release(ticket)
+            if held is None:
+                return self._reject(cost_class, f'no slot within {cost_class.max_wait}s')
+        g.admission_held = held
+        return None
+
+    def release(self):
+        for slots, held in g.pop('admission_held', None) or ():
+            slots.release(held)
+
+    def status(self):
+        result = {}
+        for name, c in self.classes.items():
+            if not c.limited:
+                result[name] = {'limited': False}
+                continue
+            result[name] = {
+                'limited': True,
+                'capacity': c.capacity,
+                'active': self.slots[name].in_use(),
+                'queued': self.queues[name].in_use(),
+                'max_queue': c.max_queue,
+                'max_wait': c.max_wait,
+            }
+        return result
+
+    def endpoint_status(self):
+        """Limited endpoints that have been called since the process started."""
+        with self._endpoint_lock:
+            entries = dict(self.endpoint_slots)
+        return {name: {'limit': limit, 'active': slots.in_use()} for name, (limit, slots) in entries.items()}
+
+    def prometheus_lines(self):
+        status = self.status()
+        lines = [
+            '# HELP benpdf_admission_active Slots in use per cost class.',
+            '# TYPE benpdf_admission_active gauge',
+        ]
+        for name, s in sorted(status.items()):
+            if s['limited']:
+                lines.append(f'benpdf_admission_active{{class="{name}"}} {s["active"]}')
+        lines.append('# HELP benpdf_admission_queued Requests waiting for a slot per cost class.')
+        lines.append('# TYPE benpdf_admission_queued gauge')
+        for name, s in sorted(status.items()):
+            if s['limited']:
+                lines.append(f'benpdf_admission_queued{{class="{name}"}} {s["queued"]}')
+        lines.append('# HELP benpdf_admission_capacity Configured slots per cost class.')
+        lines.append('# TYPE benpdf_admission_capacity gauge')
+        for name, s in sorted(status.items()):
+            if s['limited']:
+                lines.append(f'benpdf_admission_capacity{{class="{name}"}} {s["capacity"]}')
+        endpoints = self.endpoint_status()
+        if endpoints:
+            lines.append('# HELP benpdf_admission_endpoint_active Requests running per limited endpoint.')
+            lines.append('# TYPE benpdf_admission_endpoint_active gauge')
+            for name, s in sorted(endpoints.items()):
+                lines.append(f'benpdf_admission_endpoint_active{{endpoint="{name}"}} {s["active"]}')
+            lines.append('# HELP benpdf_admission_endpoint_limit Configured limit per endpoint.')
+            lines.append('# TYPE benpdf_admission_endpoint_limit gauge')
+            for name, s in sorted(endpoints.items()):
+                lines.append(f'benpdf_admission_endpoint_limit{{endpoint="{name}"}} {s["limit"]}')
+        return lines
+
+    def init_app(self, app):
+        @app.before_request
+        def _admission_before_request():
+            view = app.view_functions.get(request.endpoint)
+            if view is None:
+                return None
+            return self.admit(view, request.endpoint)
+
+        @app.teardown_request
+        def _admission_teardown_request(exc):
+            self.release()
+
+        @app.route('/api/admission', methods=['GET'])
+        def admission_status():
+            return jsonify(self.status()), 200
+
+        @app.route('/api/admission/endpoints', methods=['GET'])
+        def admission_endpoint_status():
+            return jsonify(self.endpoint_status()), 200
+
+        metrics.register_collector(self.prometheus_lines)
+
+
+def parse_classes(spec, defaults):
+    """Parse ``"cpu=4:8:2,model=1:4:5"`` (capacity:max_queue:max_wait) over ``defaults``."""
+    classes = {c.name: c for c in defaults}
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, values = part.partition('=')
+        fields = values.split(':')
+        base = classes.get(name, CostClass(name, 0, 0, 0))
+        capacity = int(fields[0]) if len(fields) > 0 and fields[0] else base.capacity
+        max_queue = int(fields[1]) if len(fields) > 1 and fields[1] else base.max_queue
+        max_wait = float(fields[2]) if len(fields) > 2 and fields[2] else base.max_wait
+        classes[name] = CostClass(name, capacity, max_queue, max_wait)
+    return list(classes.values())
+
+
+def parse_endpoint_limits(spec):
+    """Parse ``"compress_pdf_api=2,calculus_api=1"`` into ``{endpoint: limit}``."""
+    limits = {}
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, value = part.partition('=')
+        limits[name.strip()] = int(value)
+    return limits
@@ -1,28 +1,29 @@
-from flask import Flask, request, send_file, send_from_directory, flash, redirect, url_for, jsonify, after_this_request
+from flask import Flask, request, send_file, send_from_directory, flash, redirect, url_for, jsonify, after_this_request, stream_with_context
 from PIL import Image
 import os
 import io
-from pdf2docx import Converter as PdfToDocxConverter
+import json
 import logging
 import zipfile
 import glob
 import re
 import tempfile
 import sys 
-import requests 
 import subprocess
-import qrcode 
+from storage import StorageManager
+from metrics import stage_timer, init_app as init_metrics
+from profiling import RequestProfiler
+from log_pipeline import pipeline as log_pipeline
+from tools import tool_registry
+from models import model_store, preload as preload_models, DEFAULT_TIER, UnknownTierError, TierUnavailableError
+from admission import AdmissionController, CostClass, parse_classes, parse_endpoint_limits
+import image_ops
+import pdf_ops
+from static_assets import StaticAssets
 from decimal import Decimal, getcontext
-from sympy import symbols, diff, integrate, latex, Symbol, sin, cos, tan, asin, acos, atan, log, exp, sqrt, pi, E, Abs
-from sympy.core.add import Add
-from sympy.core.mul import Mul
-from sympy.parsing.sympy_parser import standard_transformations, implicit_multiplication_application, convert_xor, parse_expr
-
-try:
-    from rembg import remove as rembg_remove
-    REMBG_AVAILABLE = True
-except ImportError:
-    REMBG_AVAILABLE = False
+
+REMBG_AVAILABLE = tool_registry.available('rembg')
+if not REMBG_AVAILABLE:
     logging.warning("rembg not available. Background removal feature will be disabled.")
 
 if sys.platform == "win32":
@@ -31,13 +32,39 @@ if sys.platform == "win32":
     except ImportError:
         logging.warning("pythoncom not found. docx2pdf conversion might fail on Windows if not installed.")
 
-logging.basicConfig(level=logging.INFO)
+log_pipeline.configure()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__, static_folder='static')
+log_pipeline.init_app(app)
+init_metrics(app)
+
+profiler = RequestProfiler(
+    token=os.environ.get('PROFILE_TOKEN'),
+    sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', 0)),
+    profile_dir=os.environ.get('PROFILE_DIR'),
+    # Profiles have their own budget, outside STORAGE_QUOTA_MB.
+    quota_bytes=int(os.environ.get('PROFILE_QUOTA_MB', 256)) * 1024 * 1024,
+)
+profiler.init_app(app)
+
+_cpu_count = os.cpu_count() or 2
+admission = AdmissionController(parse_classes(os.environ.get('ADMISSION_CLASSES'), [
+    CostClass('light', capacity=0, max_queue=0, max_wait=0),
+    CostClass('cpu', capacity=_cpu_count, max_queue=_cpu_count * 2, max_wait=2.0),
+    CostClass('model', capacity=max(1, _cpu_count // 2), max_queue=4, max_wait=5.0),
+]), endpoint_limits=parse_endpoint_limits(os.environ.get('ADMISSION_ENDPOINTS')))
+admission.init_app(app)
 
 FRONTEND_DIST = os.path.join(os.path.dirname(__file__), 'New ui', 'dist')
 
+frontend = StaticAssets(
+    FRONTEND_DIST,
+    offload=os.environ.get('STATIC_OFFLOAD'),
+    offload_prefix=os.environ.get('STATIC_OFFLOAD_PREFIX', '/_frontend/'),
+)
+frontend.init_app(app)
+
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['CONVERTED_FOLDER'] = 'converted'
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024 
@@ -45,7 +72,8 @@ app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024
 @app.after_request
 def add_no_cache_headers(response):
     try:
-        if response.mimetype and 'text/html' in response.mimetype:
+        # HTML with an ETag (the frontend shell) is revalidated instead.
+        if response.mimetype and 'text/html' in response.mimetype and not response.get_etag()[0]:
             response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
             response.headers['Pragma'] = 'no-cache'
             response.headers['Expires'] = '0'
@@ -53,16 +81,72 @@ def add_no_cache_headers(response):
         pass
     return response
 
-if not os.path.exists(app.config['UPLOAD_FOLDER']):
-    os.makedirs(app.config['UPLOAD_FOLDER'])
-if not os.path.exists(app.config['CONVERTED_FOLDER']):
-    os.makedirs(app.config['CONVERTED_FOLDER'])
+# Rough ceiling on the pixel memory a single image request may use, checked
+# from the image header before decoding. 0 disables the check.
+app.config['IMAGE_MEMORY_BUDGET_MB'] = int(os.environ.get('IMAGE_MEMORY_BUDGET_MB', 512))
+# Largest image (in pixels) any image route accepts, checked from the header.
+app.config['IMAGE_MAX_PIXELS'] = int(float(os.environ.get('IMAGE_MAX_MEGAPIXELS', 100)) * 1_000_000)
+
+app.config['STORAGE_TTL_SECONDS'] = int(os.environ.get('STORAGE_TTL_SECONDS', 3600))
+# Total for uploads/ and converted/ together; each folder gets its share.
+app.config['STORAGE_QUOTA_MB'] = int(os.environ.get('STORAGE_QUOTA_MB', 1024))
+app.config['STORAGE_UPLOAD_SHARE'] = float(os.environ.get('STORAGE_UPLOAD_SHARE', 0.5))
+app.config['STORAGE_JANITOR_INTERVAL'] = int(os.environ.get('STORAGE_JANITOR_INTERVAL', 300))
+
+_storage_quota = app.config['STORAGE_QUOTA_MB'] * 1024 * 1024
+_upload_quota = int(_storage_quota * app.config['STORAGE_UPLOAD_SHARE'])
+
+upload_storage = StorageManager(
+    app.config['UPLOAD_FOLDER'],
+    default_ttl=app.config['STORAGE_TTL_SECONDS'],
+    quota_bytes=_upload_quota,
+    janitor_interval=app.config['STORAGE_JANITOR_INTERVAL'],
+)
+converted_storage = StorageManager(
+    app.config['CONVERTED_FOLDER'],
+    default_ttl=app.config['STORAGE_TTL_SECONDS'],
+    quota_bytes=_storage_quota - _upload_quota,
+    janitor_interval=app.config['STORAGE_JANITOR_INTERVAL'],
+)
+
+@app.before_request
+def start_storage_janitors():
+    upload_storage.ensure_janitor()
+    converted_storage.ensure_janitor()
+
+# Set by the ASGI entry point (asgi.py), which awaits remote image fetches
+# itself and hands the result in: {'url', 'content'} or {'url', 'error'},
+# plus 'status' when the failure is the client's (an oversized image: 413).
+PREFETCH_ENVIRON_KEY = 'benpdf.prefetched'
 
 ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 ALLOWED_DOCUMENT_EXTENSIONS = {'pdf', 'doc', 'docx'}
 ALLOWED_ICO_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
 
 
+def _image_memory_budget():
+    return app.config['IMAGE_MEMORY_BUDGET_MB'] * 1024 * 1024
+
+
+def _probe(stream, allowed_extensions):
+    with stage_timer('probe'):
+        return image_ops.probe(
+            stream,
+            allowed_formats={image_ops.OUTPUT_FORMATS[ext][0] for ext in allowed_extensions},
+            max_pixels=app.config['IMAGE_MAX_PIXELS'],
+        )
+
+
+def _probe_upload(stream, allowed_extensions):
+    """Header-only check shared by the image routes; returns an error response or None."""
+    try:
+        _probe(stream, allowed_extensions)
+    except image_ops.ProbeError as e:
+        logger.warning("Rejected image for %s: %s", request.path, e)
+        return jsonify({'error': str(e)}), e.status
+    return None
+
+
 def allowed_file(filename, allowed_extensions):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in allowed_extensions
@@ -221,7 +305,7 @@ def format_decimal_to_base(val: Decimal, base: int, precision: int = 12) -> str:
     target_info = base_map.get(target_base_str)
 
     if source_info is None or target_info is None:
-        logger.warning(f"Invalid source or target base specified: {source_base_str} -> {target_base_str}")
+        logger.warning("Invalid source or target base specified: %s -> %s", source_base_str, target_base_str)
         return jsonify({'error': 'Invalid source or target base. Choose from binary, decimal, octal, hexadecimal.'}), 400
 
     source_base = source_info['int']
@@ -253,7 +337,7 @@ def format_decimal_to_base(val: Decimal, base: int, precision: int = 12) -> str:
                     return jsonify({'error': f"Invalid hexadecimal input '{token}'. Use 0-9/A-F with optional fractional part."}), 400
 
             dec_val = parse_base_to_decimal(token_u, source_base)
-            logger.info(f"Converted '{token_u}' from base {source_base} to decimal: {dec_val}")
+            logger.info("Converted '%s' from base %s to decimal: %s", token_u, source_base, dec_val)
 
             converted_token = format_decimal_to_base(dec_val, target_base)
             results.append(converted_token)
@@ -266,13 +350,14 @@ def format_decimal_to_base(val: Decimal, base: int, precision: int = 12) -> str:
             return jsonify({'inputs': tokens, 'results': results, 'solutions': solutions}), 200
 
     except ValueError as e:
-        logger.error(f"ValueError during base conversion: {e}")
+        logger.error("ValueError during base conversion: %s", e)
         return jsonify({'error': 'Invalid number format for the specified source base.'}), 400
     except Exception as e:
         logger.exception("An unexpected error occurred during base conversion.")
         return jsonify({'error': f'An unexpected error occurred: {e}'}), 500
 
 @app.route('/api/convert-to-ico', methods=['POST'])
+@admission.cost('cpu')
 def convert_to_ico_api():
     logger.info("Received request for image to ICO conversion.")
     if 'file' not in request.files or not request.files['file'] or not request.files['file'].filename:
@@ -281,44 +366,40 @@ def convert_to_ico_api():
 
     file = request.files['file']
     filename = file.filename or ""
-    logger.info(f"Image file uploaded for ICO conversion: {filename}")
+    logger.info("Image file uploaded for ICO conversion: %s", filename)
 
     if not allowed_file(filename, ALLOWED_ICO_EXTENSIONS):
-        logger.warning(f"Invalid image file extension for ICO conversion: {filename}")
+        logger.warning("Invalid image file extension for ICO conversion: %s", filename)
         return jsonify({'error': 'Invalid image file type for ICO. Allowed: PNG, JPG, JPEG, WEBP'}), 400
 
+    rejected = _probe_upload(file.stream, ALLOWED_ICO_EXTENSIONS)
+    if rejected:
+        return rejected
+
     temp_ico_filepath = None
     try:
-        img = Image.open(file.stream)
-        logger.info(f"Image '{filename}' opened for ICO conversion.")
-
-        if img.mode != 'RGBA':
-            img = img.convert('RGBA')
-
-        icon_sizes = [(16, 16), (24, 24), (32, 32), (48, 48), (64, 64), (128, 128), (256, 256)]
-        
-        available_sizes = []
-        for size in icon_sizes:
-            if size[0] <= img.width and size[1] <= img.height:
-                available_sizes.append(size)
-        
-        if not available_sizes:
-            available_sizes = [(img.width, img.height)]
+        with stage_timer('decode'):
+            img = image_ops.open_image(
+                file.stream, budget=_image_memory_budget(),
+                target_size=(image_ops.ICO_MAX_SIZE, image_ops.ICO_MAX_SIZE),
+            )
+        logger.info("Image '%s' opened for ICO conversion.", filename)
 
         with tempfile.NamedTemporaryFile(delete=False, suffix=".ico") as temp_file:
             temp_ico_filepath = temp_file.name
-            img.save(temp_ico_filepath, format='ICO', sizes=available_sizes)
+            with stage_timer('encode'):
+                image_ops.encode(img, 'ICO', temp_file)
         
-        logger.info(f"Image converted to ICO: {temp_ico_filepath}")
+        logger.info("Image converted to ICO: %s", temp_ico_filepath)
 
         @after_this_request
         def remove_temp_ico_file(response):
             try:
                 if temp_ico_filepath and os.path.exists(temp_ico_filepath):
                     os.remove(temp_ico_filepath)
-                    logger.info(f"Cleaned up temporary ICO file: {temp_ico_filepath}")
+                    logger.info("Cleaned up temporary ICO file: %s", temp_ico_filepath)
             except Exception as e:
-                logger.error(f"Error during temporary ICO file cleanup: {e}")
+                logger.error("Error during temporary ICO file cleanup: %s", e)
             return response
 
         original_filename_no_ext = os.path.splitext(filename)[0]
@@ -330,9 +411,12 @@ def convert_to_ico_api():
             as_attachment=True,
             download_name=download_filename
         )
-        logger.info(f"Sending converted ICO file: {download_filename}")
+        logger.info("Sending converted ICO file: %s", download_filename)
         return response
 
+    except image_ops.MemoryBudgetError as e:
+        logger.warning("Rejected image for ICO conversion: %s", e)
+        return jsonify({'error': str(e)}), 413
     except Image.UnidentifiedImageError:
         logger.error("Uploaded file for ICO conversion is not a recognized image format.")
         return jsonify({'error': 'Could not identify image file. Please ensure it is a valid image.'}), 400
@@ -342,10 +426,11 @@ def convert_to_ico_api():
             try:
                 os.remove(temp_ico_filepath)
             except Exception as cleanup_e:
-                logger.error(f"Error cleaning up ICO temp file on error: {cleanup_e}")
+                logger.error("Error cleaning up ICO temp file on error: %s", cleanup_e)
         return jsonify({'error': f'An error occurred during ICO conversion: {e}'}), 500
 
 @app.route('/api/resize-image', methods=['POST'])
+@admission.cost('cpu')
 def resize_image_api():
     logger.info("Received request for image resizing.")
     if 'file' not in request.files or not request.files['file'] or not request.files['file'].filename:
@@ -357,10 +442,10 @@ def resize_image_api():
     target_width_str = request.form.get('width')
     target_height_str = request.form.get('height')
     
-    logger.info(f"Image file uploaded for resizing: {filename}, Target dimensions: {target_width_str}x{target_height_str}")
+    logger.info("Image file uploaded for resizing: %s, Target dimensions: %sx%s", filename, target_width_str, target_height_str)
 
     if not allowed_file(filename, ALLOWED_IMAGE_EXTENSIONS): 
-        logger.warning(f"Invalid image file extension for resizing: {filename}")
+        logger.warning("Invalid image file extension for resizing: %s", filename)
         return jsonify({'error': 'Invalid image file type for resizing. Allowed: PNG, JPG, JPEG, GIF, WEBP'}), 400
     
     if not target_width_str or not target_height_str:
@@ -375,47 +460,34 @@ def resize_image_api():
     except ValueError:
         return jsonify({'error': 'Width and height must be valid integers.'}), 400
 
+    rejected = _probe_upload(file.stream, ALLOWED_IMAGE_EXTENSIONS)
+    if rejected:
+        return rejected
+
     output_buffer = io.BytesIO()
     original_filename_no_ext = os.path.splitext(filename)[0]
     original_ext = os.path.splitext(filename)[1].lower()
     download_filename = f"{original_filename_no_ext}_resized_{target_width}x{target_height}{original_ext}"
     
     try:
-        img = Image.open(file.stream)
-        logger.info(f"Image '{filename}' opened for resizing.")
+        with stage_timer('decode'):
+            img = image_ops.open_image(
+                file.stream, budget=_image_memory_budget(),
+                extra_bytes=2 * image_ops.decoded_size(target_width, target_height, 'RGBA'),
+                target_size=(target_width, target_height),
+            )
+        logger.info("Image '%s' opened for resizing.", filename)
 
-        
-        try:
-            from PIL.Image import Resampling
-            LANCZOS_FILTER = Resampling.LANCZOS
-        except ImportError:
-            LANCZOS_FILTER = getattr(Image, 'LANCZOS', None)
-            if LANCZOS_FILTER is None:
-                raise ImportError('No LANCZOS filter found in PIL.Image. Please update your Pillow library.')
-       
-        resized_img = img.resize((target_width, target_height), LANCZOS_FILTER) 
-        
-        
-        output_format = 'PNG'
-        mimetype = 'image/png'
-        if original_ext in ['.jpg', '.jpeg']:
-            output_format = 'JPEG'
-            mimetype = 'image/jpeg'
-        elif original_ext == '.gif':
-            output_format = 'GIF'
-            mimetype = 'image/gif'
-        elif original_ext == '.webp':
-            output_format = 'WEBP'
-            mimetype = 'image/webp'
+        with stage_timer('process'):
+            resized_img = image_ops.resize(img, target_width, target_height)
 
-        
-        if output_format == 'JPEG' and resized_img.mode == 'RGBA':
-            resized_img = resized_img.convert('RGB')
-        
-        resized_img.save(output_buffer, format=output_format)
+        output_format, mimetype, _ = image_ops.OUTPUT_FORMATS.get(original_ext.lstrip('.'), image_ops.OUTPUT_FORMATS['png'])
+
+        with stage_timer('encode'):
+            image_ops.encode(resized_img, output_format, output_buffer)
         output_buffer.seek(0)
         
-        logger.info(f"Image resized to {target_width}x{target_height} and saved to buffer.")
+        logger.info("Image resized to %sx%s and saved to buffer.", target_width, target_height)
 
         response = send_file(
             output_buffer,
@@ -423,9 +495,12 @@ def resize_image_api():
             as_attachment=True,
             download_name=download_filename
         )
-        logger.info(f"Sending resized image: {download_filename}")
+        logger.info("Sending resized image: %s", download_filename)
         return response
 
+    except image_ops.MemoryBudgetError as e:
+        logger.warning("Rejected image for resizing: %s", e)
+        return jsonify({'error': str(e)}), 413
     except Image.UnidentifiedImageError:
         logger.error("Uploaded file for resizing is not a recognized image format.")
         return jsonify({'error': 'Could not identify image file. Please ensure it is a valid image.'}), 400
@@ -434,8 +509,10 @@ def resize_image_api():
         return jsonify({'error': f'An error occurred during image resizing: {e}'}), 500
 
 @app.route('/api/generate-qrcode', methods=['POST'])
+@admission.cost('cpu')
 def generate_qrcode_api():
     logger.info("Received request for QR code generation.")
+    qrcode = tool_registry.load('qrcode')
     
     if request.content_type and request.content_type.startswith('multipart/form-data'):
         url = request.form.get('url')
@@ -476,8 +553,9 @@ def generate_qrcode_api():
             box_size=10,
             border=4,
         )
-        qr.add_data(url)
-        qr.make(fit=True)
+        with stage_timer('process'):
+            qr.add_data(url)
+            qr.make(fit=True)
 
         qr_img = None
         if style == 'rounded':
@@ -486,7 +564,7 @@ def generate_qrcode_api():
                 from qrcode.image.styles.moduledrawers import RoundedModuleDrawer
                 qr_img = qr.make_image(image_factory=StyledPilImage, module_drawer=RoundedModuleDrawer(), fill_color=fg_color, back_color=bg_color).convert('RGBA')
             except Exception as e:
-                logger.warning(f"Failed to use rounded style: {e}")
+                logger.warning("Failed to use rounded style: %s", e)
                 qr_img = qr.make_image(fill_color=fg_color, back_color=bg_color).convert('RGBA')
         elif style == 'dots':
             try:
@@ -494,7 +572,7 @@ def generate_qrcode_api():
                 from qrcode.image.styles.moduledrawers import CircleModuleDrawer
                 qr_img = qr.make_image(image_factory=StyledPilImage, module_drawer=CircleModuleDrawer(), fill_color=fg_color, back_color=bg_color).convert('RGBA')
             except Exception as e:
-                logger.warning(f"Failed to use dots style: {e}")
+                logger.warning("Failed to use dots style: %s", e)
                 qr_img = qr.make_image(fill_color=fg_color, back_color=bg_color).convert('RGBA')
         else:
             qr_img = qr.make_image(fill_color=fg_color, back_color=bg_color).convert('RGBA')
@@ -502,53 +580,53 @@ def generate_qrcode_api():
         qr_width, qr_height = qr_img.size
         logo_size = int(min(qr_width, qr_height) * (logo_size_percent / 100.0))
         from PIL import ImageDraw
-        logger.info(f"Logo file check: logo_file = {logo_file}, type = {type(logo_file)}")
+        logger.debug("Logo file check: logo_file = %s, type = %s", logo_file, type(logo_file))
         if logo_file and logo_file.filename:
             logo_img = None
             try:
-                logger.info(f"Logo file received: {logo_file.filename}, content_type: {logo_file.content_type}")
+                logger.debug("Logo file received: %s, content_type: %s", logo_file.filename, logo_file.content_type)
                 
                 logo_file.stream.seek(0)
                 file_content = logo_file.stream.read()
-                logger.info(f"Read {len(file_content)} bytes from upload")
+                logger.debug("Read %s bytes from upload", len(file_content))
                 
                 if len(file_content) >= 8:
                     magic_bytes = file_content[:8]
-                    logger.info(f"File signature (first 8 bytes): {magic_bytes.hex()}")
+                    logger.debug("File signature (first 8 bytes): %s", magic_bytes.hex())
                     
                     
                     detected_format = None
                     if file_content[:2] == b'\xff\xd8':
                         detected_format = 'JPEG'
-                        logger.info("Detected JPEG signature")
+                        logger.debug("Detected JPEG signature")
                     elif file_content[:8] == b'\x89PNG\r\n\x1a\n':
                         detected_format = 'PNG'
-                        logger.info("Detected PNG signature")
+                        logger.debug("Detected PNG signature")
                     elif file_content[:4] in [b'RIFF', b'WEBP']:
                         detected_format = 'WEBP'
-                        logger.info("Detected WebP signature")
+                        logger.debug("Detected WebP signature")
                     elif file_content[:4] == b'GIF8':
                         detected_format = 'GIF'
-                        logger.info("Detected GIF signature")
+                        logger.debug("Detected GIF signature")
                     elif b'ftyp' in file_content[:12]:
                         
                         if b'avif' in file_content[:32] or b'avis' in file_content[:32]:
                             detected_format = 'AVIF'
-                            logger.info("Detected AVIF signature")
+                            logger.debug("Detected AVIF signature")
                         elif b'heic' in file_content[:32] or b'heix' in file_content[:32] or b'mif1' in file_content[:32]:
                             detected_format = 'HEIF'
-                            logger.info("Detected HEIF/HEIC signature")
+                            logger.debug("Detected HEIF/HEIC signature")
                         else:
                             detected_format = 'HEIF'
-                            logger.info("Detected HEIF-based container (could be AVIF or HEIC)")
+                            logger.debug("Detected HEIF-based container (could be AVIF or HEIC)")
                     else:
-                        logger.warning(f"Unknown or invalid image signature - file may be corrupted or not an image")
+                        logger.warning("Unknown or invalid image signature - file may be corrupted or not an image")
                 
                 
                 try:
                     from pillow_heif import register_heif_opener
                     register_heif_opener()
-                    logger.info("HEIF/AVIF support registered")
+                    logger.debug("HEIF/AVIF support registered")
                 except ImportError:
                     logger.warning("pillow-heif not available, HEIF/AVIF formats won't be supported")
                 
@@ -556,9 +634,9 @@ def generate_qrcode_api():
                     logo_img = Image.open(io.BytesIO(file_content))
                     if hasattr(logo_img, 'format') and logo_img.format == 'JPEG':
                         logo_img.load()  
-                    logger.info(f"Method 1 SUCCESS - Logo format: {logo_img.format}, mode: {logo_img.mode}, size: {logo_img.size}")
+                    logger.debug("Method 1 SUCCESS - Logo format: %s, mode: %s, size: %s", logo_img.format, logo_img.mode, logo_img.size)
                 except Exception as e1:
-                    logger.warning(f"Method 1 (BytesIO) failed: {e1}")
+                    logger.warning("Method 1 (BytesIO) failed: %s", e1)
                     
                     
                     if detected_format in ['AVIF', 'HEIF']:
@@ -571,9 +649,9 @@ def generate_qrcode_api():
                                 heif_file.data,
                                 "raw"
                             )
-                            logger.info(f"Method 1b SUCCESS - pillow_heif direct read, size: {logo_img.size}")
+                            logger.debug("Method 1b SUCCESS - pillow_heif direct read, size: %s", logo_img.size)
                         except Exception as e1b:
-                            logger.warning(f"Method 1b (pillow_heif direct) failed: {e1b}")
+                            logger.warning("Method 1b (pillow_heif direct) failed: %s", e1b)
                             logo_img = None
                     
                     
@@ -592,11 +670,11 @@ def generate_qrcode_api():
                                     img_cv = cv2.cvtColor(img_cv, cv2.COLOR_BGRA2RGBA)
                                 
                                 logo_img = Image.fromarray(img_cv)
-                                logger.info(f"Method 2 SUCCESS - OpenCV conversion succeeded, size: {logo_img.size}")
+                                logger.debug("Method 2 SUCCESS - OpenCV conversion succeeded, size: %s", logo_img.size)
                             else:
                                 raise Exception("OpenCV could not decode image")
                         except Exception as e2:
-                            logger.warning(f"Method 2 (OpenCV) failed: {e2}")
+                            logger.warning("Method 2 (OpenCV) failed: %s", e2)
                         
                         try:
                             if detected_format == 'AVIF':
@@ -608,7 +686,7 @@ def generate_qrcode_api():
                             else:
                                 file_ext = os.path.splitext(logo_file.filename)[1] or '.jpg'
                             
-                            logger.info(f"Trying temp file method with extension: {file_ext}")
+                            logger.debug("Trying temp file method with extension: %s", file_ext)
                             
                             with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as temp_file:
                                 temp_file.write(file_content)
@@ -617,9 +695,9 @@ def generate_qrcode_api():
                             try:
                                 logo_img = Image.open(temp_path)
                                 logo_img.load()  
-                                logger.info(f"Method 3 SUCCESS - Temp file method succeeded, format: {logo_img.format}")
+                                logger.debug("Method 3 SUCCESS - Temp file method succeeded, format: %s", logo_img.format)
                             except Exception as e3_inner:
-                                logger.warning(f"Method 3a (temp file PIL) failed: {e3_inner}")
+                                logger.warning("Method 3a (temp file PIL) failed: %s", e3_inner)
                                 
                                 img_cv = cv2.imread(temp_path, cv2.IMREAD_UNCHANGED)
                                 if img_cv is not None:
@@ -628,16 +706,16 @@ def generate_qrcode_api():
                                     elif len(img_cv.shape) == 3 and img_cv.shape[2] == 4:
                                         img_cv = cv2.cvtColor(img_cv, cv2.COLOR_BGRA2RGBA)
                                     logo_img = Image.fromarray(img_cv)
-                                    logger.info(f"Method 3b SUCCESS - OpenCV from temp file succeeded")
+                                    logger.debug("Method 3b SUCCESS - OpenCV from temp file succeeded")
                                 else:
                                     raise Exception("OpenCV could not read temp file")
                             finally:
                                 if os.path.exists(temp_path):
                                     os.remove(temp_path)
                         except Exception as e3:
-                            logger.warning(f"Method 3 (temp file) failed: {e3}")
+                            logger.warning("Method 3 (temp file) failed: %s", e3)
                             
-                            logger.error(f"All image decoding methods failed for {logo_file.filename}. The file may be corrupted or in an unsupported format. QR code will be generated without logo.")
+                            logger.error("All image decoding methods failed for %s. The file may be corrupted or in an unsupported format. QR code will be generated without logo.", logo_file.filename)
                             logo_img = None
                 
                 if logo_img:
@@ -645,25 +723,25 @@ def generate_qrcode_api():
                     logo_img = logo_img.resize((logo_size, logo_size), Image.LANCZOS)
                     pos = ((qr_width - logo_size) // 2, (qr_height - logo_size) // 2)
                     qr_img.paste(logo_img, pos, mask=logo_img)
-                    logger.info(f"Logo pasted successfully at position {pos} with size {logo_size}x{logo_size}")
+                    logger.debug("Logo pasted successfully at position %s with size %sx%s", pos, logo_size, logo_size)
                 else:
                     logger.warning("Logo could not be loaded - QR code generated without logo")
                 
             except Exception as e:
-                import traceback
-                logger.error(f"Failed to embed logo: {e}\n{traceback.format_exc()}")
+                logger.exception("Failed to embed logo: %s", e)
                 overlay = Image.new('RGBA', (logo_size, logo_size), (255, 0, 0, 0))
                 draw = ImageDraw.Draw(overlay)
                 draw.ellipse((0, 0, logo_size, logo_size), fill=(255, 0, 0, 180))
                 pos = ((qr_width - logo_size) // 2, (qr_height - logo_size) // 2)
                 qr_img.paste(overlay, pos, mask=overlay)
         else:
-            logger.info("No logo file provided or filename is empty")
+            logger.debug("No logo file provided or filename is empty")
 
         output_buffer = io.BytesIO()
-        qr_img.save(output_buffer, format='PNG')
+        with stage_timer('encode'):
+            qr_img.save(output_buffer, format='PNG')
         output_buffer.seek(0)
-        logger.info(f"QR code generated successfully for URL: {url}")
+        logger.info("QR code generated successfully for URL: %s", url)
         response = send_file(
             output_buffer,
             mimetype='image/png',
@@ -774,6 +852,7 @@ def convert_unit_api():
 
 
 @app.route('/api/calculus', methods=['POST'])
+@admission.cost('cpu', weight=2, limit=2)
 def calculus_api():
     """Perform symbolic derivative or integral calculations.
     JSON body:
@@ -789,6 +868,7 @@ def calculus_api():
     Response includes plain result, LaTeX, and lightweight term-by-term steps.
     """
     logger.info("Received request for calculus computation.")
+    sp = tool_registry.load('sympy')
     data = request.get_json(silent=True)
     if not data:
         return jsonify({'error': 'No JSON body provided.'}), 400
@@ -810,20 +890,21 @@ def calculus_api():
     if not isinstance(var_name, str) or not var_name.isidentifier():
         return jsonify({'error': 'Invalid variable name.'}), 400
 
-    allowed_symbols = {var_name: Symbol(var_name)}
+    allowed_symbols = {var_name: sp.Symbol(var_name)}
     allowed_functions = {
-        'sin': sin, 'cos': cos, 'tan': tan,
-        'asin': asin, 'acos': acos, 'atan': atan,
-        'log': log, 'ln': log, 'exp': exp, 'sqrt': sqrt,
-        'pi': pi, 'E': E, 'abs': Abs
+        'sin': sp.sin, 'cos': sp.cos, 'tan': sp.tan,
+        'asin': sp.asin, 'acos': sp.acos, 'atan': sp.atan,
+        'log': sp.log, 'ln': sp.log, 'exp': sp.exp, 'sqrt': sp.sqrt,
+        'pi': sp.pi, 'E': sp.E, 'abs': sp.Abs
     }
     local_dict = {**allowed_symbols, **allowed_functions}
 
-    transformations = (standard_transformations + (implicit_multiplication_application,) + (convert_xor,))
+    transformations = sp.transformations
     try:
-        expr = parse_expr(expression_str, local_dict=local_dict, transformations=transformations, evaluate=True)
+        with stage_timer('parse'):
+            expr = sp.parse_expr(expression_str, local_dict=local_dict, transformations=transformations, evaluate=True)
     except Exception as e:
-        logger.warning(f"Sympify failed for expression '{expression_str}': {e}")
+        logger.warning("Sympify failed for expression '%s': %s", expression_str, e)
         return jsonify({'error': f'Failed to parse expression: {e}'}), 400
 
     var = allowed_symbols[var_name]
@@ -840,85 +921,84 @@ def calculus_api():
         except Exception:
             return repr(term)
 
-    if operation == 'derivative':
-        from sympy import expand
-        target_expr = expr
-        expanded = expand(target_expr)
-        if expanded != target_expr:
-            steps.append(f"Expand: {target_expr} = {expanded}")
-            steps_latex.append(f"{latex(target_expr)} = {latex(expanded)}")
-            target_expr = expanded
-        if isinstance(target_expr, Add):
-            steps.append("Linearity: d/d%s of sum = sum of d/d%s of each term" % (var_name, var_name))
-            steps_latex.append(f"\n" + latex(target_expr))
-            for term in target_expr.args:
-                d_term = diff(term, var, 1)
-                steps.append(f"d/d{var_name} {term_string(term)} = {term_string(d_term)}")
-                steps_latex.append(f"\\frac{{d}}{{d{var_name}}}({latex(term)}) = {latex(d_term)}")
-            if order > 1:
-                higher = diff(target_expr, var, order)
-                steps.append(f"Higher order derivative (order {order}): {higher}")
-                steps_latex.append(f"\\frac{{d^{order}}}{{d{var_name}^{ {order} }}}({latex(target_expr)}) = {latex(higher)}")
-        else:
-            d_expr = diff(target_expr, var, order)
-            steps.append(f"Derivative order {order}: {d_expr}")
-            steps_latex.append(f"\\frac{{d^{order}}}{{d{var_name}^{ {order} }}}({latex(target_expr)}) = {latex(d_expr)}")
-        result = diff(expr, var, order)
-        if simplify_flag:
-            try:
-                result = result.simplify()
-            except Exception:
-                pass
-    else:  
-        if lower is not None and upper is not None:
-            is_definite = True
-        from sympy import expand
-        target_expr = expr
-        expanded = expand(target_expr)
-        if expanded != target_expr:
-            steps.append(f"Expand: {target_expr} = {expanded}")
-            steps_latex.append(f"{latex(target_expr)} = {latex(expanded)}")
-            target_expr = expanded
-        if isinstance(target_expr, Add):
-            steps.append("Linearity: ∫ sum = sum of integrals")
-            steps_latex.append(latex(target_expr))
-            for term in target_expr.args:
-                int_term = integrate(term, var)
-                steps.append(f"∫ {term_string(term)} d{var_name} = {term_string(int_term)}")
-                steps_latex.append(f"∫ {latex(term)} \\mathrm{{d}}{var_name} = {latex(int_term)}")
-        else:
-            int_expr = integrate(target_expr, var)
-            steps.append(f"Integrate: ∫ {target_expr} d{var_name} = {int_expr}")
-            steps_latex.append(f"∫ {latex(target_expr)} \\mathrm{{d}}{var_name} = {latex(int_expr)}")
-        if is_definite:
-            try:
-                lower_expr = parse_expr(str(lower), local_dict=local_dict, transformations=transformations, evaluate=True)
-                upper_expr = parse_expr(str(upper), local_dict=local_dict, transformations=transformations, evaluate=True)
-            except Exception as e:
-                return jsonify({'error': f'Failed to parse bounds: {e}'}), 400
-            result = integrate(expr, (var, lower_expr, upper_expr))
-            steps.append(f"Evaluate definite integral from {lower} to {upper} -> {result}")
-            steps_latex.append(f"\\left[ {latex(integrate(expr, var))} \\right]_{{{latex(lower_expr)}}}^{{{latex(upper_expr)}}} = {latex(result)}")
-            try:
+    with stage_timer('process'):
+        if operation == 'derivative':
+            target_expr = expr
+            expanded = sp.expand(target_expr)
+            if expanded != target_expr:
+                steps.append(f"Expand: {target_expr} = {expanded}")
+                steps_latex.append(f"{sp.latex(target_expr)} = {sp.latex(expanded)}")
+                target_expr = expanded
+            if isinstance(target_expr, sp.Add):
+                steps.append("Linearity: d/d%s of sum = sum of d/d%s of each term" % (var_name, var_name))
+                steps_latex.append(f"\n" + sp.latex(target_expr))
+                for term in target_expr.args:
+                    d_term = sp.diff(term, var, 1)
+                    steps.append(f"d/d{var_name} {term_string(term)} = {term_string(d_term)}")
+                    steps_latex.append(f"\\frac{{d}}{{d{var_name}}}({sp.latex(term)}) = {sp.latex(d_term)}")
+                if order > 1:
+                    higher = sp.diff(target_expr, var, order)
+                    steps.append(f"Higher order derivative (order {order}): {higher}")
+                    steps_latex.append(f"\\frac{{d^{order}}}{{d{var_name}^{ {order} }}}({sp.latex(target_expr)}) = {sp.latex(higher)}")
+            else:
+                d_expr = sp.diff(target_expr, var, order)
+                steps.append(f"Derivative order {order}: {d_expr}")
+                steps_latex.append(f"\\frac{{d^{order}}}{{d{var_name}^{ {order} }}}({sp.latex(target_expr)}) = {sp.latex(d_expr)}")
+            result = sp.diff(expr, var, order)
+            if simplify_flag:
+                try:
+                    result = result.simplify()
+                except Exception:
+                    pass
+        else:  
+            if lower is not None and upper is not None:
+                is_definite = True
+            target_expr = expr
+            expanded = sp.expand(target_expr)
+            if expanded != target_expr:
+                steps.append(f"Expand: {target_expr} = {expanded}")
+                steps_latex.append(f"{sp.latex(target_expr)} = {sp.latex(expanded)}")
+                target_expr = expanded
+            if isinstance(target_expr, sp.Add):
+                steps.append("Linearity: ∫ sum = sum of integrals")
+                steps_latex.append(sp.latex(target_expr))
+                for term in target_expr.args:
+                    int_term = sp.integrate(term, var)
+                    steps.append(f"∫ {term_string(term)} d{var_name} = {term_string(int_term)}")
+                    steps_latex.append(f"∫ {sp.latex(term)} \\mathrm{{d}}{var_name} = {sp.latex(int_term)}")
+            else:
+                int_expr = sp.integrate(target_expr, var)
+                steps.append(f"Integrate: ∫ {target_expr} d{var_name} = {int_expr}")
+                steps_latex.append(f"∫ {sp.latex(target_expr)} \\mathrm{{d}}{var_name} = {sp.latex(int_expr)}")
+            if is_definite:
                 try:
-                    numeric_approx = float(result.evalf())
+                    lower_expr = sp.parse_expr(str(lower), local_dict=local_dict, transformations=transformations, evaluate=True)
+                    upper_expr = sp.parse_expr(str(upper), local_dict=local_dict, transformations=transformations, evaluate=True)
+                except Exception as e:
+                    return jsonify({'error': f'Failed to parse bounds: {e}'}), 400
+                result = sp.integrate(expr, (var, lower_expr, upper_expr))
+                steps.append(f"Evaluate definite integral from {lower} to {upper} -> {result}")
+                steps_latex.append(f"\\left[ {sp.latex(sp.integrate(expr, var))} \\right]_{{{sp.latex(lower_expr)}}}^{{{sp.latex(upper_expr)}}} = {sp.latex(result)}")
+                try:
+                    try:
+                        numeric_approx = float(result.evalf())
+                    except Exception:
+                        numeric_approx = None
                 except Exception:
                     numeric_approx = None
-            except Exception:
-                numeric_approx = None
-        else:
-            result = integrate(expr, var)
-            steps.append("Add constant of integration C.")
-            steps_latex.append("+ C")
-        if simplify_flag:
-            try:
-                result = result.simplify()
-            except Exception:
-                pass
+            else:
+                result = sp.integrate(expr, var)
+                steps.append("Add constant of integration C.")
+                steps_latex.append("+ C")
+            if simplify_flag:
+                try:
+                    result = result.simplify()
+                except Exception:
+                    pass
 
     result_str = str(result)
     try:
-        result_latex = latex(result)
+        result_latex = sp.latex(result)
     except Exception:
         result_latex = result_str
 
@@ -939,6 +1019,257 @@ def calculus_api():
     return jsonify(response_payload), 200
 
 
+@app.route('/api/probe', methods=['POST'])
+def probe_image_api():
+    """Report an image's format, size, frames and mode from its header alone.
+
+    Takes a multipart ``file`` or the raw bytes as the request body; the
+    first 64 KB of a file is normally enough. ``?route=ico`` checks against
+    the ICO route's formats instead of the general image ones.
+    """
+    if request.mimetype == 'multipart/form-data':
+        if 'file' not in request.files or not request.files['file'].filename:
+            return jsonify({'error': 'No image file uploaded.'}), 400
+        stream = request.files['file'].stream
+        route = request.values.get('route')
+    else:
+        # Whatever the Content-Type says, the body is the image: don't let
+        # form parsing consume it.
+        body = request.get_data(parse_form_data=False)
+        if not body:
+            return jsonify({'error': 'No image file uploaded.'}), 400
+        stream = io.BytesIO(body)
+        route = request.args.get('route')
+
+    route = (route or '').strip().lower()
+    allowed_extensions = ALLOWED_ICO_EXTENSIONS if route == 'ico' else ALLOWED_IMAGE_EXTENSIONS
+    try:
+        info = _probe(stream, allowed_extensions)
+    except image_ops.ProbeError as e:
+        return jsonify({'error': str(e)}), e.status
+
+    budget = _image_memory_budget()
+    info['fits_memory_budget'] = not budget or info['decoded_bytes'] <= budget
+    return jsonify(info), 200
+
+
+def _spool_pdf(file):
+    """Save an uploaded PDF to upload storage so PyMuPDF can read it from disk."""
+    path = upload_storage.new_path('.pdf')
+    file.save(path)
+    return upload_storage.commit(path)
+
+
+def _remove_files(paths):
+    for path in paths:
+        try:
+            if path and os.path.exists(path):
+                os.remove(path)
+        except OSError as e:
+            logger.error("Error cleaning up %s: %s", path, e)
+
+
+def _send_output(path, **kwargs):
+    """``send_file`` a per-request output, then delete it.
+
+    The response already holds the file open, so it is unlinked right away
+    and stays readable until the response is closed. (``call_on_close``
+    doesn't run for ``send_file`` responses, which bypass ``close``.) Where
+    an open file can't be removed, the storage janitor gets it later.
+    """
+    response = send_file(path, **kwargs)
+    try:
+        os.remove(path)
+    except OSError as e:
+        logger.debug("Leaving %s to the storage janitor: %s", path, e)
+    return response
+
+
+def _pdf_upload():
+    """Return ``(file, None)`` for a valid single PDF upload, else ``(None, error response)``."""
+    if 'file' not in request.files or not request.files['file'] or not request.files['file'].filename:
+        return None, (jsonify({'error': 'No PDF file uploaded.'}), 400)
+    file = request.files['file']
+    if not allowed_file(file.filename, {'pdf'}):
+        return None, (jsonify({'error': 'Invalid file type. Please upload a PDF.'}), 400)
+    return file, None
+
+
+@app.route('/api/pdf/merge', methods=['POST'])
+@admission.cost('cpu')
+def merge_pdf_api():
+    logger.info("Received request for PDF merge.")
+    files = [f for f in request.files.getlist('files') if f and f.filename]
+    if len(files) < 2:
+        return jsonify({'error': 'Upload at least two PDF files to merge.'}), 400
+    if len(files) > pdf_ops.MAX_MERGE_FILES:
+        return jsonify({'error': f'At most {pdf_ops.MAX_MERGE_FILES} files can be merged at once.'}), 400
+    if not all(allowed_file(f.filename, {'pdf'}) for f in files):
+        return jsonify({'error': 'Invalid file type. Only PDF files can be merged.'}), 400
+    pymupdf = tool_registry.load('pymupdf')
+
+    paths = []
+    try:
+        with stage_timer('spool'):
+            for f in files:
+                paths.append(_spool_pdf(f))
+        with stage_timer('process'):
+            pdf_ops.merge(pymupdf, paths[0], paths[1:])
+        merged_path = converted_storage.new_path('.pdf')
+        os.replace(paths[0], merged_path)
+        paths[0] = None
+        converted_storage.commit(merged_path)
+    except pdf_ops.PdfError as e:
+        _remove_files(paths)
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        _remove_files(paths)
+        logger.exception("An error occurred while merging PDFs.")
+        return jsonify({'error': f'An error occurred while merging PDFs: {e}'}), 500
+    _remove_files(paths)
+
+    download_filename = f"{os.path.splitext(files[0].filename)[0]}_merged.pdf"
+    logger.info("Sending merged PDF: %s", download_filename)
+    return _send_output(merged_path, mimetype='application/pdf', as_attachment=True, download_name=download_filename)
+
+
+@app.route('/api/pdf/extract', methods=['POST'])
+@admission.cost('cpu')
+def extract_pdf_pages_api():
+    logger.info("Received request for PDF page extraction.")
+    file, error = _pdf_upload()
+    if error:
+        return error
+    pymupdf = tool_registry.load('pymupdf')
+
+    input_path = output_path = None
+    try:
+        with stage_timer('spool'):
+            input_path = _spool_pdf(file)
+        doc = pdf_ops.open_pdf(pymupdf, input_path)
+        page_count = doc.page_count
+        doc.close()
+        ranges = pdf_ops.parse_page_ranges(request.form.get('pages', ''), page_count)
+        output_path = converted_storage.new_path('.pdf')
+        with stage_timer('process'):
+            pdf_ops.extract(pymupdf, input_path, output_path, ranges)
+        converted_storage.commit(output_path)
+    except pdf_ops.PdfError as e:
+        _remove_files([output_path])
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        _remove_files([output_path])
+        logger.exception("An error occurred while extracting PDF pages.")
+        return jsonify({'error': f'An error occurred while extracting pages: {e}'}), 500
+    finally:
+        _remove_files([input_path])
+
+    download_filename = f"{os.path.splitext(file.filename)[0]}_pages.pdf"
+    return _send_output(output_path, mimetype='application/pdf', as_attachment=True, download_name=download_filename)
+
+
+@app.route('/api/pdf/split', methods=['POST'])
+@admission.cost('cpu')
+def split_pdf_api():
+    """Split a PDF into parts, streamed back as a ZIP.
+
+    ``pages`` (e.g. ``1-3,4-10``) gives one part per range; otherwise the
+    document is cut every ``every`` pages (default 1).
+    """
+    logger.info("Received request for PDF split.")
+    file, error = _pdf_upload()
+    if error:
+        return error
+    pymupdf = tool_registry.load('pymupdf')
+
+    input_path = None
+    try:
+        with stage_timer('spool'):
+            input_path = _spool_pdf(file)
+        doc = pdf_ops.open_pdf(pymupdf, input_path)
+        page_count = doc.page_count
+        doc.close()
+        if request.form.get('pages', '').strip():
+            ranges = pdf_ops.parse_page_ranges(request.form['pages'], page_count)
+        else:
+            try:
+                every = int(request.form.get('every', 1))
+            except ValueError:
+                every = 0
+            if every < 1:
+                raise pdf_ops.PdfError('every must be a positive integer.')
+            ranges = pdf_ops.chunk_ranges(page_count, every)
+    except pdf_ops.PdfError as e:
+        _remove_files([input_path])
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        _remove_files([input_path])
+        logger.exception("An error occurred while preparing the PDF split.")
+        return jsonify({'error': f'An error occurred while splitting the PDF: {e}'}), 500
+
+    stem = os.path.splitext(file.filename)[0]
+
+    def generate():
+        try:
+            with stage_timer('process'):
+                yield from pdf_ops.stream_zip(pdf_ops.split(pymupdf, input_path, ranges, stem=stem))
+        finally:
+            _remove_files([input_path])
+
+    logger.info("Streaming %s parts of %s", len(ranges), file.filename)
+    return app.response_class(
+        stream_with_context(generate()),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{stem}_split.zip"'},
+    )
+
+
+@app.route('/api/pdf/compress', methods=['POST'])
+@admission.cost('cpu', limit=2)
+def compress_pdf_api():
+    """Garbage-collect and recompress a PDF; ``image_dpi`` also downsamples images."""
+    logger.info("Received request for PDF compression.")
+    file, error = _pdf_upload()
+    if error:
+        return error
+    try:
+        image_dpi = int(request.form['image_dpi']) if request.form.get('image_dpi') else None
+        image_quality = int(request.form.get('image_quality', 75))
+    except ValueError:
+        return jsonify({'error': 'image_dpi and image_quality must be integers.'}), 400
+    if image_dpi is not None and not 36 <= image_dpi <= 600:
+        return jsonify({'error': 'image_dpi must be between 36 and 600.'}), 400
+    if not 1 <= image_quality <= 100:
+        return jsonify({'error': 'image_quality must be between 1 and 100.'}), 400
+    pymupdf = tool_registry.load('pymupdf')
+
+    input_path = output_path = None
+    try:
+        with stage_timer('spool'):
+            input_path = _spool_pdf(file)
+        output_path = converted_storage.new_path('.pdf')
+        with stage_timer('process'):
+            pdf_ops.compress(pymupdf, input_path, output_path, image_dpi=image_dpi, image_quality=image_quality)
+        converted_storage.commit(output_path)
+        original_size = os.path.getsize(input_path)
+    except pdf_ops.PdfError as e:
+        _remove_files([output_path])
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        _remove_files([output_path])
+        logger.exception("An error occurred while compressing the PDF.")
+        return jsonify({'error': f'An error occurred while compressing the PDF: {e}'}), 500
+    finally:
+        _remove_files([input_path])
+
+    compressed_size = os.path.getsize(output_path)
+    logger.info("Compressed %s from %s to %s bytes", file.filename, original_size, compressed_size)
+    download_filename = f"{os.path.splitext(file.filename)[0]}_compressed.pdf"
+    response = _send_output(output_path, mimetype='application/pdf', as_attachment=True, download_name=download_filename)
+    response.headers['X-Original-Size'] = str(original_size)
+    return response
+
+
 @app.route('/healthz', methods=['GET'])
 def healthz():
     """Simple health check endpoint for Render/containers."""
@@ -949,64 +1280,116 @@ def healthz():
             'status': 'ok',
             'templates': templates_ok,
             'uploads': uploads_ok,
-            'rembg': REMBG_AVAILABLE
+            'rembg': REMBG_AVAILABLE,
+            'tools': tool_registry.status(),
+            'rembg_tiers': model_store.available_tiers(),
         }), 200
     except Exception as e:
         return jsonify({'status': 'error', 'detail': str(e)}), 500
 @app.route('/api/remove-background', methods=['POST'])
+@admission.cost('model')
 def remove_background_api():
     logger.info("Received request for background removal.")
     
     if not REMBG_AVAILABLE:
         return jsonify({'error': 'Background removal feature is not available. Please install rembg: pip install rembg'}), 503
+    requests = tool_registry.load('requests')
     
     file = None
     image_url = None
 
     if 'file' in request.files and request.files['file'].filename != '':
         file = request.files['file']
-        logger.info(f"File uploaded for background removal: {file.filename}")
+        logger.info("File uploaded for background removal: %s", file.filename)
         if not allowed_file(file.filename, ALLOWED_IMAGE_EXTENSIONS):
-            logger.warning(f"Invalid image file extension: {file.filename}")
+            logger.warning("Invalid image file extension: %s", file.filename)
             return jsonify({'error': 'Invalid image file type. Allowed: PNG, JPG, JPEG, GIF, WEBP'}), 400
+        rejected = _probe_upload(file.stream, ALLOWED_IMAGE_EXTENSIONS)
+        if rejected:
+            return rejected
     elif 'url' in request.form and request.form['url'].strip() != '':
         image_url = request.form['url'].strip()
-        logger.info(f"Image URL provided for background removal: {image_url}")
+        logger.info("Image URL provided for background removal: %s", image_url)
         if not (image_url.startswith('http://') or image_url.startswith('https://')):
-            logger.warning(f"Invalid URL format: {image_url}")
+            logger.warning("Invalid URL format: %s", image_url)
             return jsonify({'error': 'Invalid URL format. Must start with http:// or https://'}), 400
     else:
         logger.warning("No file or URL provided for background removal.")
         return jsonify({'error': 'No image file uploaded or URL provided.'}), 400
 
+    tier = (request.form.get('tier') or request.args.get('tier') or '').strip().lower() or None
+    inference = (request.form.get('inference') or 'auto').strip().lower()
+    output_mode = (request.form.get('output') or 'image').strip().lower()
+    if inference not in image_ops.INFERENCE_MODES:
+        return jsonify({'error': f"Invalid inference mode. Choose from: {', '.join(image_ops.INFERENCE_MODES)}"}), 400
+    if output_mode not in ('image', 'mask'):
+        return jsonify({'error': 'Invalid output. Choose image or mask.'}), 400
+    try:
+        compress_level = int(request.form.get('compression', 6))
+    except ValueError:
+        return jsonify({'error': 'compression must be an integer from 0 to 9.'}), 400
+    if not 0 <= compress_level <= 9:
+        return jsonify({'error': 'compression must be an integer from 0 to 9.'}), 400
+
+    try:
+        session, tier = model_store.get_session(tier)
+    except UnknownTierError:
+        return jsonify({'error': f"Invalid tier '{tier}'. Choose from: {', '.join(model_store.available_tiers())}"}), 400
+    except TierUnavailableError:
+        return jsonify({'error': f"Tier '{tier}' is not available on this server. Choose from: {', '.join(model_store.available_tiers())}"}), 503
+    except Exception as e:
+        logger.exception("Failed to load background removal model for tier %s.", tier)
+        return jsonify({'error': f'Could not load background removal model: {e}'}), 500
+
     output_buffer = io.BytesIO()
     
     try:
-        input_data = None
+        input_stream = None
         original_filename = "image"
         
         if file:
             original_filename = os.path.splitext(file.filename or "image")[0]
             file.stream.seek(0)
-            input_data = file.stream.read()
-            logger.info(f"Read {len(input_data)} bytes from uploaded file")
+            input_stream = file.stream
         elif image_url:
-            logger.info(f"Fetching image from URL: {image_url}")
-            response = requests.get(image_url, stream=True)
-            response.raise_for_status()
-            input_data = response.content
-            logger.info(f"Image fetched from URL, size: {len(input_data)} bytes")
-
-        logger.info("Processing background removal...")
-        output_data = rembg_remove(input_data)
+            prefetched = request.environ.get(PREFETCH_ENVIRON_KEY)
+            if prefetched is not None and prefetched['url'] == image_url:
+                if 'error' in prefetched:
+                    logger.error("Error fetching URL: %s", prefetched['error'])
+                    return jsonify({'error': f"Failed to fetch image from URL: {prefetched['error']}"}), prefetched.get('status', 500)
+                input_data = prefetched['content']
+            else:
+                logger.info("Fetching image from URL: %s", image_url)
+                with stage_timer('fetch'):
+                    response = requests.get(image_url, stream=True)
+                    response.raise_for_status()
+                    input_data = response.content
+            logger.info("Image fetched from URL, size: %s bytes", len(input_data))
+            input_stream = io.BytesIO(input_data)
+            rejected = _probe_upload(input_stream, ALLOWED_IMAGE_EXTENSIONS)
+            if rejected:
+                return rejected
+
+        with stage_timer('decode'):
+            img = image_ops.open_image(
+                input_stream, budget=_image_memory_budget(),
+                working_bpp=image_ops.REMOVE_BACKGROUND_WORKING_BPP,
+            )
+
+        logger.info("Processing background removal with tier %s (%s inference)...", tier, inference)
+        with stage_timer('process'):
+            result = image_ops.remove_background(
+                img, tool_registry.load('rembg'), session,
+                inference=inference, mask_only=output_mode == 'mask',
+            )
         
-        img = Image.open(io.BytesIO(output_data))
-        
-        img.save(output_buffer, format='PNG')
+        with stage_timer('encode'):
+            result.save(output_buffer, format='PNG', compress_level=compress_level)
         output_buffer.seek(0)
 
-        converted_filename = f"{original_filename}_no_bg.png"
-        logger.info(f"Background removed successfully: {converted_filename}")
+        suffix = 'mask' if output_mode == 'mask' else 'no_bg'
+        converted_filename = f"{original_filename}_{suffix}.png"
+        logger.info("Background removed successfully: %s", converted_filename)
 
         response = send_file(
             output_buffer,
@@ -1014,17 +1397,128 @@ def remove_background_api():
             as_attachment=True,
             download_name=converted_filename
         )
-        logger.info(f"Sending image with background removed: {converted_filename}")
+        response.headers['X-Model-Tier'] = tier
+        response.headers['X-Model-Name'] = model_store.model_name(tier)
+        logger.info("Sending image with background removed: %s", converted_filename)
         return response
 
+    except image_ops.MemoryBudgetError as e:
+        logger.warning("Rejected image for background removal: %s", e)
+        return jsonify({'error': str(e)}), 413
     except requests.exceptions.RequestException as e:
-        logger.error(f"Error fetching URL: {e}")
+        logger.error("Error fetching URL: %s", e)
         return jsonify({'error': f"Failed to fetch image from URL: {e}"}), 500
     except Exception as e:
         logger.exception("An unexpected error occurred during background removal.")
         return jsonify({'error': f'An unexpected error occurred: {e}'}), 500
 
 
+def _pipeline_operations():
+    try:
+        return json.loads(request.form.get('operations') or '')
+    except ValueError:
+        return None
+
+
+def _pipeline_cost():
+    operations = _pipeline_operations()
+    if isinstance(operations, list) and any(isinstance(step, dict) and step.get('op') == 'remove_background' for step in operations):
+        return ('model', 1)
+    return ('cpu', 1)
+
+
+@app.route('/api/image-pipeline', methods=['POST'])
+@admission.cost(_pipeline_cost)
+def image_pipeline_api():
+    """Run several image operations on one upload, decoding and encoding once.
+
+    ``operations`` is a JSON list such as
+    ``[{"op": "remove_background", "tier": "fast"}, {"op": "resize", "width": 256, "height": 256}, {"op": "encode", "format": "ico"}]``.
+    """
+    logger.info("Received request for image pipeline.")
+    if 'file' not in request.files or not request.files['file'] or not request.files['file'].filename:
+        return jsonify({'error': 'No image file uploaded.'}), 400
+    file = request.files['file']
+    if not allowed_file(file.filename, ALLOWED_IMAGE_EXTENSIONS):
+        return jsonify({'error': 'Invalid image file type. Allowed: PNG, JPG, JPEG, GIF, WEBP'}), 400
+
+    operations = _pipeline_operations()
+    if operations is None:
+        return jsonify({'error': 'operations must be a JSON list.'}), 400
+    try:
+        steps, output = image_ops.parse_pipeline(operations)
+    except image_ops.PipelineError as e:
+        return jsonify({'error': str(e)}), 400
+
+    rejected = _probe_upload(file.stream, ALLOWED_IMAGE_EXTENSIONS)
+    if rejected:
+        return rejected
+
+    # Resolve model sessions before decoding, so bad tiers fail fast.
+    rembg = None
+    tiers = []
+    for step in steps:
+        if step['op'] != 'remove_background':
+            continue
+        if not REMBG_AVAILABLE:
+            return jsonify({'error': 'Background removal feature is not available. Please install rembg: pip install rembg'}), 503
+        try:
+            step['session'], step['tier'] = model_store.get_session(step['tier'])
+        except UnknownTierError:
+            return jsonify({'error': f"Invalid tier '{step['tier']}'. Choose from: {', '.join(model_store.available_tiers())}"}), 400
+        except TierUnavailableError:
+            return jsonify({'error': f"Tier '{step['tier']}' is not available on this server. Choose from: {', '.join(model_store.available_tiers())}"}), 503
+        except Exception as e:
+            logger.exception("Failed to load background removal model for tier %s.", step['tier'])
+            return jsonify({'error': f'Could not load background removal model: {e}'}), 500
+        rembg = tool_registry.load('rembg')
+        tiers.append(step['tier'])
+
+    output_format, mimetype, ext = image_ops.OUTPUT_FORMATS[output['format']]
+    download_filename = f"{os.path.splitext(file.filename)[0]}_processed{ext}"
+    output_buffer = io.BytesIO()
+
+    try:
+        with stage_timer('decode'):
+            img = image_ops.open_image(file.stream, budget=_image_memory_budget(), **image_ops.pipeline_footprint(steps, output))
+
+        logger.info("Running image pipeline: %s -> %s", ', '.join(step['op'] for step in steps), output_format)
+        with stage_timer('process'):
+            img = image_ops.run_pipeline(img, steps, rembg=rembg)
+
+        with stage_timer('encode'):
+            image_ops.encode(img, output_format, output_buffer,
+                             compress_level=output['compression'], quality=output['quality'])
+        output_buffer.seek(0)
+
+        response = send_file(
+            output_buffer,
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=download_filename
+        )
+        if tiers:
+            response.headers['X-Model-Tier'] = ','.join(tiers)
+        return response
+
+    except image_ops.MemoryBudgetError as e:
+        logger.warning("Rejected image for the image pipeline: %s", e)
+        return jsonify({'error': str(e)}), 413
+    except Image.UnidentifiedImageError:
+        logger.error("Uploaded file for the image pipeline is not a recognized image format.")
+        return jsonify({'error': 'Could not identify image file. Please ensure it is a valid image.'}), 400
+    except Exception as e:
+        logger.exception("An error occurred in the image pipeline.")
+        return jsonify({'error': f'An error occurred while processing the image: {e}'}), 500
+
+
+if os.environ.get('PRELOAD_MODELS', 'false').lower() == 'true':
+    preload_models(
+        tools=[t for t in os.environ.get('PRELOAD_TOOLS', 'sympy,qrcode,requests,pymupdf,rembg').split(',') if t],
+        tiers=[t for t in os.environ.get('REMBG_PRELOAD_TIERS', DEFAULT_TIER).split(',') if t],
+    )
+
+
 if __name__ == '__main__':
     import os
     debug_mode = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
@@ -0,0 +1,276 @@
+"""ASGI entry point: ``uvicorn asgi:app`` or
+``gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app``.
+
+The Flask app is unchanged and still does all the work; this layer only
+keeps slow I/O off its threads. Request bodies are received and remote
+images for ``/api/remove-background`` are fetched on the event loop, then
+the request runs in a bounded thread pool. A request waiting on a slow
+upload or a slow remote server therefore holds no thread, and one process
+can keep hundreds of them in flight while at most
+``ASGI_WORKER_THREADS`` requests do CPU work at a time.
+"""
+import contextvars
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import anyio
+import anyio.to_thread
+import httpx
+from werkzeug.formparser import parse_form_data
+
+from app import app as wsgi_app, PREFETCH_ENVIRON_KEY, REMBG_AVAILABLE
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Bodies up to this size stay in memory; larger uploads spool to disk.
+SPOOL_MAX_MEMORY = 1024 * 1024
+
+# A URL-only form is tiny; anything bigger carries a file and needs no fetch.
+PREFETCH_FORM_LIMIT = 64 * 1024
+
+PREFETCH_ROUTE = '/api/remove-background'
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+class AsgiBridge:
+    """Serve a WSGI app over ASGI, awaiting network I/O outside its threads.
+
+    ``threads`` bounds how many threads run the WSGI app at once, both
+    handling a request and producing its response chunks. Spooling request
+    bodies to disk uses anyio's default thread pool, so uploads never
+    queue behind CPU work.
+    """
+
+    def __init__(self, wsgi, threads=None, fetch_timeout=30.0, max_fetch_bytes=None):
+        self.wsgi = wsgi
+        self.threads = threads or int(os.environ.get('ASGI_WORKER_THREADS', (os.cpu_count() or 2) * 2))
+        self.fetch_timeout = fetch_timeout
+        self.max_fetch_bytes = max_fetch_bytes or wsgi.config.get('MAX_CONTENT_LENGTH')
+        self.limiter = None
+        self.client = None
+
+    def _ensure_started(self):
+        if self.limiter is None:
+            self.limiter = anyio.CapacityLimiter(self.threads)
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                follow_redirects=True,
+                timeout=self.fetch_timeout,
+                limits=httpx.Limits(max_connections=None, max_keepalive_connections=20),
+            )
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            self._ensure_started()
+            await self._http(scope, receive, send)
+        else:
+            raise RuntimeError(f"Unsupported ASGI scope type {scope['type']!r}")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self._ensure_started()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.client is not None:
+                    await self.client.aclose()
+                    self.client = None
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _read_body(self, receive, limit=None):
+        """Spool the request body; raises ``BodyTooLarge`` as soon as it passes ``limit``."""
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+        size = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None, 0
+            chunk = message.get('body', b'')
+            if limit and size + len(chunk) > limit:
+                body.close()
+                raise BodyTooLarge()
+            if chunk:
+                # Writes past SPOOL_MAX_MEMORY go to disk; keep them off the loop.
+                if size + len(chunk) > SPOOL_MAX_MEMORY:
+                    await anyio.to_thread.run_sync(body.write, chunk)
+                else:
+                    body.write(chunk)
+                size += len(chunk)
+            more_body = message.get('more_body', False)
+        body.seek(0)
+        return body, size
+
+    async def _prefetch(self, environ, body_size):
+        """Fetch the remote image of a URL-only remove-background request."""
+        if (environ['REQUEST_METHOD'] != 'POST' or environ['PATH_INFO'] != PREFETCH_ROUTE
+                or not REMBG_AVAILABLE or body_size > PREFETCH_FORM_LIMIT):
+            return
+        body = environ['wsgi.input']
+        try:
+            _, form, files = parse_form_data(dict(environ))
+        finally:
+            body.seek(0)
+        if 'file' in files and files['file'].filename:
+            return
+        url = (form.get('url') or '').strip()
+        if not (url.startswith('http://') or url.startswith('https://')):
+            return
+
+        logger.info("Fetching image from URL: %s", url)
+        start = time.perf_counter()
+        try:
+            async with self.client.stream('GET', url) as response:
+                response.raise_for_status()
+                content = bytearray()
+                async for chunk in response.aiter_bytes():
+                    content += chunk
+                    if self.max_fetch_bytes and len(content) > self.max_fetch_bytes:
+                        environ[PREFETCH_ENVIRON_KEY] = {
+                            'url': url, 'status': 413,
+                            'error': f'Remote image is larger than {self.max_fetch_bytes // (1024 * 1024)} MB.',
+                        }
+                        return
+            environ[PREFETCH_ENVIRON_KEY] = {'url': url, 'content': bytes(content)}
+        except httpx.HTTPError as e:
+            environ[PREFETCH_ENVIRON_KEY] = {'url': url, 'error': str(e) or e.__class__.__name__}
+        finally:
+            metrics.observe_stage(PREFETCH_ROUTE, 'fetch', time.perf_counter() - start)
+
+    @staticmethod
+    def _environ(scope, body, body_size):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        root_path = scope.get('root_path', '')
+        path = scope['path']
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+            'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'CONTENT_LENGTH': str(body_size),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').lower()
+            value = value.decode('latin-1')
+            if name == 'content-length':
+                continue
+            if name == 'content-type':
+                environ['CONTENT_TYPE'] = value
+                continue
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    def _call_wsgi(self, environ):
+        state = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and state.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            state['status'] = int(status.split(' ', 1)[0])
+            state['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+            return lambda data: state.setdefault('writes', []).append(data)
+
+        result = self.wsgi(environ, start_response)
+        return state, result
+
+    @staticmethod
+    async def _send_error(send, status, message):
+        data = json.dumps({'error': message}).encode('utf-8')
+        await send({'type': 'http.response.start', 'status': status, 'headers': [
+            (b'content-type', b'application/json'), (b'content-length', str(len(data)).encode('latin-1')),
+            (b'connection', b'close'),
+        ]})
+        await send({'type': 'http.response.body', 'body': data, 'more_body': False})
+
+    @staticmethod
+    def _declared_length(scope):
+        for name, value in scope.get('headers', []):
+            if name.lower() == b'content-length':
+                try:
+                    return int(value)
+                except ValueError:
+                    return None
+        return None
+
+    async def _http(self, scope, receive, send):
+        # Refuse oversized uploads before spooling them, as Flask would after.
+        limit = self.wsgi.config.get('MAX_CONTENT_LENGTH')
+        declared = self._declared_length(scope)
+        try:
+            if limit and declared is not None and declared > limit:
+                raise BodyTooLarge()
+            body, body_size = await self._read_body(receive, limit)
+        except BodyTooLarge:
+            await self._send_error(send, 413, f'Request body is larger than {limit // (1024 * 1024)} MB.')
+            return
+        if body is None:
+            return
+        try:
+            environ = self._environ(scope, body, body_size)
+            await self._prefetch(environ, body_size)
+            # One context for the whole request: each worker thread call
+            # would otherwise get a fresh copy, and stream_with_context
+            # generators need the Flask context they pushed to still be
+            # there on the next chunk.
+            context = contextvars.copy_context()
+
+            def run(func, *args):
+                return anyio.to_thread.run_sync(context.run, func, *args, limiter=self.limiter)
+
+            state, result = await run(self._call_wsgi, environ)
+            try:
+                state['sent'] = True
+                await send({'type': 'http.response.start', 'status': state['status'], 'headers': state['headers']})
+                for data in state.get('writes', []):
+                    await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+                if isinstance(result, (list, tuple)):
+                    for chunk in result:
+                        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                else:
+                    # File reads and generators (PDF split builds each part
+                    # as it goes) run off the loop, within the thread limit.
+                    iterator = iter(result)
+                    while True:
+                        chunk = await run(next, iterator, None)
+                        if chunk is None:
+                            break
+                        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+            finally:
+                close = getattr(result, 'close', None)
+                if close is not None:
+                    await run(close)
+        finally:
+            body.close()
+
+
+app = AsgiBridge(wsgi_app, fetch_timeout=float(os.environ.get('ASGI_FETCH_TIMEOUT', 30)))
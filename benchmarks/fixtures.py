@@ -0,0 +1,109 @@
+"""Deterministic synthetic inputs for the benchmark suite.
+
+Everything is generated from fixed seeds so two runs on the same machine
+exercise exactly the same bytes.
+"""
+import io
+import random
+
+from PIL import Image, ImageDraw
+
+SEED = 1234
+
+IMAGE_SIZES = {
+    'small': (256, 256),
+    'medium': (1024, 768),
+    'large': (3000, 2000),
+}
+
+IMAGE_FORMATS = {
+    'png': ('PNG', 'image/png'),
+    'jpg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+    'gif': ('GIF', 'image/gif'),
+}
+
+EXPRESSIONS = [
+    ('x^2 + 3*x + 2', 'derivative', {}),
+    ('sin(x)*x^2 + 3*x', 'derivative', {}),
+    ('exp(x)*cos(x)', 'derivative', {'order': 3}),
+    ('log(x)/x', 'derivative', {'order': 2}),
+    ('sqrt(1 + x^2)', 'derivative', {}),
+    ('x^3 - 2*x + 1', 'integral', {}),
+    ('x*exp(x)', 'integral', {}),
+    ('sin(x)^2', 'integral', {}),
+    ('1/(1 + x^2)', 'integral', {'lower': '0', 'upper': '1'}),
+    ('x*sin(x)', 'integral', {'lower': '0', 'upper': 'pi'}),
+]
+
+UNIT_CONVERSIONS = [
+    (100, 'celsius', 'fahrenheit', 'temperature'),
+    (12.5, 'miles', 'kilometers', 'length'),
+    (3, 'pounds', 'grams', 'mass'),
+    (451, 'fahrenheit', 'kelvin', 'temperature'),
+]
+
+
+def make_image(size, fmt, seed=SEED):
+    """Return encoded image bytes of ``size`` in Pillow format ``fmt``."""
+    rng = random.Random(f"{seed}-{size}-{fmt}")
+    width, height = size
+    img = Image.linear_gradient('L').resize(size).convert('RGB')
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = x0 + rng.randrange(1, width // 3 + 2), y0 + rng.randrange(1, height // 3 + 2)
+        color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        if rng.random() < 0.5:
+            draw.ellipse((x0, y0, x1, y1), fill=color)
+        else:
+            draw.rectangle((x0, y0, x1, y1), fill=color)
+    if fmt in ('PNG', 'WEBP'):
+        img = img.convert('RGBA')
+    buf = io.BytesIO()
+    img.save(buf, format=fmt)
+    return buf.getvalue()
+
+
+def image_corpus(sizes=None, formats=None):
+    """Map ``(size_name, ext)`` to ``(bytes, mimetype)`` for every combination."""
+    corpus = {}
+    for size_name in sizes or IMAGE_SIZES:
+        for ext in formats or IMAGE_FORMATS:
+            fmt, mimetype = IMAGE_FORMATS[ext]
+            corpus[(size_name, ext)] = (make_image(IMAGE_SIZES[size_name], fmt), mimetype)
+    return corpus
+
+
+def make_pdf(pages=10, seed=SEED):
+    """Return a text-and-shapes PDF with ``pages`` pages, or None without PyMuPDF."""
+    try:
+        import pymupdf
+    except ImportError:
+        return None
+    rng = random.Random(f"{seed}-pdf-{pages}")
+    doc = pymupdf.open()
+    for i in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Benchmark page {i + 1}", fontsize=18)
+        for line in range(30):
+            words = ' '.join(f"w{rng.randrange(10000)}" for _ in range(10))
+            page.insert_text((72, 110 + line * 20), words, fontsize=10)
+        rect = pymupdf.Rect(72, 720, 72 + rng.randrange(50, 400), 760)
+        page.draw_rect(rect, color=(0, 0, 1), fill=(rng.random(), rng.random(), rng.random()))
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def base_conversion_batch(count=1000, base=16, seed=SEED):
+    """Return ``count`` random numbers written in ``base``, some with fractions."""
+    rng = random.Random(f"{seed}-base-{base}-{count}")
+    digits = '0123456789ABCDEF'[:base]
+    tokens = []
+    for _ in range(count):
+        integer = ''.join(rng.choice(digits) for _ in range(rng.randrange(1, 24)))
+        if rng.random() < 0.3:
+            integer += '.' + ''.join(rng.choice(digits) for _ in range(rng.randrange(1, 8)))
+        tokens.append(integer)
+    return tokens
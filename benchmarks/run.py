@@ -0,0 +1,353 @@
+"""Benchmark and load-test driver for every API route.
+
+Runs each case concurrently against the Flask app in-process (or against a
+live server with ``--url``), prints throughput and latency percentiles and
+compares them with a stored baseline.
+
+    python -m benchmarks.run                      # run and compare with baseline
+    python -m benchmarks.run --save-baseline      # record a new baseline
+    python -m benchmarks.run --only resize --concurrency 16 --requests 200
+
+rembg is replaced with a cheap deterministic stub so the suite runs offline
+and measures our own overhead rather than model inference.
+"""
+import argparse
+import importlib.machinery
+import importlib.util
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from benchmarks import fixtures
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def install_rembg_stub():
+    """Register a fake ``rembg`` module that keeps the image and adds a flat alpha."""
+    def remove(data, *args, only_mask=False, **kwargs):
+        img = data if isinstance(data, Image.Image) else Image.open(io.BytesIO(data))
+        if only_mask:
+            return Image.new('L', img.size, 200)
+        img = img.convert('RGBA')
+        img.putalpha(200)
+        if isinstance(data, Image.Image):
+            return img
+        buf = io.BytesIO()
+        img.save(buf, format='PNG')
+        return buf.getvalue()
+
+    stub = types.ModuleType('rembg')
+    stub.__spec__ = importlib.machinery.ModuleSpec('rembg', None)
+    stub.remove = remove
+    stub.new_session = lambda *args, **kwargs: object()
+    sys.modules['rembg'] = stub
+    if importlib.util.find_spec('onnxruntime') is None:
+        ort = types.ModuleType('onnxruntime')
+        ort.__spec__ = importlib.machinery.ModuleSpec('onnxruntime', None)
+        sys.modules['onnxruntime'] = ort
+
+
+class Case:
+    """One benchmarked request shape. ``make_request`` returns kwargs for the client."""
+
+    def __init__(self, name, method, path, make_request=None, expect=200):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.make_request = make_request or (lambda: {})
+        self.expect = expect
+
+
+def _upload(data, filename, **form):
+    def make():
+        payload = dict(form)
+        payload['file'] = (io.BytesIO(data), filename)
+        return {'data': payload, 'content_type': 'multipart/form-data'}
+    return make
+
+
+# Cut-out favicon: background removal, resize and ICO encode in one request.
+PIPELINE_ICON = json.dumps([
+    {'op': 'remove_background', 'inference': 'lowres'},
+    {'op': 'resize', 'width': 256, 'height': 256},
+    {'op': 'encode', 'format': 'ico'},
+])
+
+
+def build_cases():
+    cases = [
+        Case('healthz', 'GET', '/healthz'),
+        Case('metrics', 'GET', '/metrics'),
+    ]
+
+    images = fixtures.image_corpus()
+    for (size_name, ext), (data, _) in sorted(images.items()):
+        cases.append(Case(f'probe/{size_name}/{ext}', 'POST', '/api/probe', _upload(data, f'bench.{ext}')))
+        cases.append(Case(f'resize/{size_name}/{ext}', 'POST', '/api/resize-image',
+                          _upload(data, f'bench.{ext}', width='200', height='150')))
+        if ext != 'gif':
+            cases.append(Case(f'ico/{size_name}/{ext}', 'POST', '/api/convert-to-ico',
+                              _upload(data, f'bench.{ext}')))
+        if ext in ('png', 'jpg'):
+            cases.append(Case(f'remove-bg/{size_name}/{ext}', 'POST', '/api/remove-background',
+                              _upload(data, f'bench.{ext}')))
+            cases.append(Case(f'remove-bg-mask/{size_name}/{ext}', 'POST', '/api/remove-background',
+                              _upload(data, f'bench.{ext}', output='mask', inference='lowres', compression='1')))
+            cases.append(Case(f'pipeline/{size_name}/{ext}', 'POST', '/api/image-pipeline',
+                              _upload(data, f'bench.{ext}', operations=PIPELINE_ICON)))
+
+    cases.append(Case('qrcode/plain', 'POST', '/api/generate-qrcode',
+                      lambda: {'json': {'url': 'https://example.com/benchmark', 'style': 'square'}}))
+    cases.append(Case('qrcode/rounded', 'POST', '/api/generate-qrcode',
+                      lambda: {'json': {'url': 'https://example.com/benchmark', 'style': 'rounded'}}))
+    logo = images[('small', 'png')][0]
+    cases.append(Case('qrcode/logo', 'POST', '/api/generate-qrcode', lambda: {
+        'data': {'url': 'https://example.com/benchmark', 'logo': (io.BytesIO(logo), 'logo.png')},
+        'content_type': 'multipart/form-data',
+    }))
+
+    for i, (value, from_unit, to_unit, unit_type) in enumerate(fixtures.UNIT_CONVERSIONS):
+        body = {'value': value, 'fromUnit': from_unit, 'toUnit': to_unit, 'unitType': unit_type}
+        cases.append(Case(f'unit/{unit_type}/{i}', 'POST', '/api/convert-unit', lambda body=body: {'json': body}))
+
+    for i, (expression, operation, extra) in enumerate(fixtures.EXPRESSIONS):
+        body = {'expression': expression, 'operation': operation, **extra}
+        cases.append(Case(f'calculus/{operation}/{i}', 'POST', '/api/calculus', lambda body=body: {'json': body}))
+
+    for pages in (10, 100):
+        pdf = fixtures.make_pdf(pages=pages)
+        if pdf is None:
+            break
+        cases.append(Case(f'pdf-merge/{pages}', 'POST', '/api/pdf/merge', lambda pdf=pdf: {
+            'data': {'files': [(io.BytesIO(pdf), 'a.pdf'), (io.BytesIO(pdf), 'b.pdf')]},
+            'content_type': 'multipart/form-data',
+        }))
+        cases.append(Case(f'pdf-extract/{pages}', 'POST', '/api/pdf/extract', _upload(pdf, 'bench.pdf', pages='1-3,5')))
+        cases.append(Case(f'pdf-split/{pages}', 'POST', '/api/pdf/split', _upload(pdf, 'bench.pdf', every='5')))
+        cases.append(Case(f'pdf-compress/{pages}', 'POST', '/api/pdf/compress', _upload(pdf, 'bench.pdf')))
+
+    return cases
+
+
+def build_function_cases(app_module):
+    """Benchmarks of helpers that have no route of their own."""
+    cases = {}
+    for base in (2, 8, 16):
+        batch = fixtures.base_conversion_batch(count=2000, base=base)
+
+        def run(batch=batch, base=base):
+            for token in batch:
+                value = app_module.parse_base_to_decimal(token, base)
+                app_module.generate_conversion_steps(token.split('.')[0], base, 10, int(value))
+        cases[f'base-batch/{base}'] = run
+    return cases
+
+
+class LocalTarget:
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self._local = threading.local()
+
+    def request(self, case):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(case.path, method=case.method, **case.make_request())
+        response.get_data()
+        return response.status_code
+
+
+class RemoteTarget:
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.session_factory = requests.Session
+        self._local = threading.local()
+
+    def request(self, case):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self.session_factory()
+        kwargs = case.make_request()
+        if 'data' in kwargs and kwargs.pop('content_type', None):
+            files = {k: v for k, v in kwargs['data'].items() if isinstance(v, tuple)}
+            kwargs['data'] = {k: v for k, v in kwargs['data'].items() if not isinstance(v, tuple)}
+            kwargs['files'] = files
+        response = session.request(case.method, self.base_url + case.path, **kwargs)
+        return response.status_code
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(latencies, errors, wall):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / wall if wall > 0 else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p90_ms': percentile(latencies, 90) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': (latencies[-1] * 1000) if latencies else 0.0,
+    }
+
+
+def run_case(target, case, total_requests, concurrency, warmup):
+    for _ in range(warmup):
+        target.request(case)
+
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            status = target.request(case)
+        except Exception:
+            status = None
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if status != case.expect:
+                errors += 1
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total_requests)))
+    return summarize(latencies, errors, time.perf_counter() - wall_start)
+
+
+def run_function(fn, repeat, warmup):
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    wall_start = time.perf_counter()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies, 0, time.perf_counter() - wall_start)
+
+
+def compare(results, baseline, threshold):
+    """Return a list of human readable regressions of ``results`` against ``baseline``."""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        if previous['p50_ms'] > 0 and current['p50_ms'] > previous['p50_ms'] * (1 + threshold):
+            regressions.append(f"{name}: p50 {previous['p50_ms']:.2f}ms -> {current['p50_ms']:.2f}ms")
+        if previous['p99_ms'] > 0 and current['p99_ms'] > previous['p99_ms'] * (1 + threshold * 2):
+            regressions.append(f"{name}: p99 {previous['p99_ms']:.2f}ms -> {current['p99_ms']:.2f}ms")
+        if previous['rps'] > 0 and current['rps'] < previous['rps'] * (1 - threshold):
+            regressions.append(f"{name}: throughput {previous['rps']:.1f}/s -> {current['rps']:.1f}/s")
+        if current['errors'] > previous.get('errors', 0):
+            regressions.append(f"{name}: {current['errors']} unexpected responses")
+    return regressions
+
+
+def print_table(results):
+    header = f"{'case':<34} {'reqs':>6} {'err':>4} {'req/s':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    print(header)
+    print('-' * len(header))
+    for name, r in results.items():
+        print(f"{name:<34} {r['requests']:>6} {r['errors']:>4} {r['rps']:>9.1f} "
+              f"{r['p50_ms']:>9.2f} {r['p90_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['max_ms']:>9.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='benchmark a running server instead of the in-process app')
+    parser.add_argument('--only', action='append', default=[], help='run cases whose name contains this (repeatable)')
+    parser.add_argument('--requests', type=int, default=40, help='requests per case')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed relative slowdown before flagging')
+    parser.add_argument('--json', help='also write results to this file')
+    parser.add_argument('--admission', action='store_true',
+                        help='keep admission control limits on for the in-process app')
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.WARNING)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+
+    if args.url:
+        target = RemoteTarget(args.url)
+        app_module = None
+    else:
+        install_rembg_stub()
+        if not args.admission:
+            os.environ['ADMISSION_CLASSES'] = 'cpu=0,model=0'
+        os.chdir(REPO_ROOT)
+        import app as app_module
+        target = LocalTarget(app_module.app)
+
+    def selected(name):
+        return not args.only or any(o in name for o in args.only)
+
+    results = {}
+    for case in build_cases():
+        if selected(case.name):
+            results[case.name] = run_case(target, case, args.requests, args.concurrency, args.warmup)
+    if app_module is not None:
+        for name, fn in build_function_cases(app_module).items():
+            if selected(name):
+                results[name] = run_function(fn, max(args.requests // 10, 3), 1)
+
+    print_table(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\nBaseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to create one.")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print('\nRegressions against baseline:')
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print('\nNo regressions against baseline.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
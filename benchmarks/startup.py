@@ -0,0 +1,89 @@
+"""Startup cost of app.py and of each lazily loaded tool.
+
+Every measurement runs in a fresh interpreter so imports cached by an
+earlier step don't hide the cost of a later one.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --repeat 5 --json startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import json, logging, os, sys, time
+sys.path.insert(0, {root!r})
+os.chdir({root!r})
+logging.disable(logging.WARNING)
+from tools import current_rss_bytes
+rss0 = current_rss_bytes()
+t0 = time.perf_counter()
+import app
+app_seconds = time.perf_counter() - t0
+rss1 = current_rss_bytes()
+result = {{'app_import_seconds': app_seconds, 'app_rss_bytes': rss1, 'app_rss_delta_bytes': rss1 - rss0}}
+tool = {tool!r}
+if tool:
+    registry = app.tool_registry
+    if not registry.available(tool):
+        result['tool'] = None
+    else:
+        with app.app.test_request_context('/'):
+            registry.load(tool)
+        t = registry.tools[tool]
+        result['tool'] = {{'load_seconds': t.load_seconds, 'rss_delta_bytes': t.rss_delta}}
+print(json.dumps(result))
+"""
+
+
+def measure(tool=None):
+    code = PROBE.format(root=REPO_ROOT, tool=tool)
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='also write results to this file')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, REPO_ROOT)
+    from tools import tool_registry
+
+    runs = [measure() for _ in range(args.repeat)]
+    results = {
+        'app': {
+            'import_seconds': statistics.median(r['app_import_seconds'] for r in runs),
+            'rss_bytes': statistics.median(r['app_rss_bytes'] for r in runs),
+        },
+        'tools': {},
+    }
+    print(f"app.py import: {results['app']['import_seconds'] * 1000:.0f} ms, "
+          f"RSS {results['app']['rss_bytes'] / 2**20:.1f} MiB")
+
+    print(f"\n{'tool':<12} {'load ms':>10} {'RSS +MiB':>10}")
+    for name in tool_registry.tools:
+        samples = [measure(name)['tool'] for _ in range(args.repeat)]
+        if samples[0] is None:
+            results['tools'][name] = None
+            print(f"{name:<12} {'not installed':>21}")
+            continue
+        load = statistics.median(s['load_seconds'] for s in samples)
+        rss = statistics.median(s['rss_delta_bytes'] for s in samples)
+        results['tools'][name] = {'load_seconds': load, 'rss_delta_bytes': rss}
+        print(f"{name:<12} {load * 1000:>10.0f} {rss / 2**20:>10.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
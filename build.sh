@@ -2,6 +2,14 @@ set -o errexit
 
 pip install -r requirements.txt
 
+# Build the frontend and precompress it (.br/.gz) for static serving.
+if command -v npm >/dev/null 2>&1; then
+  (cd "New ui" && npm ci && npm run build)
+fi
+if [ -d "New ui/dist" ]; then
+  python static_assets.py compress "New ui/dist"
+fi
+
 apt-get update
 apt-get install -y libreoffice libreoffice-writer
 
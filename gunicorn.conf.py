@@ -0,0 +1,34 @@
+import gc
+import os
+
+# Import the app (and with it the models) once in the master, then fork.
+# Workers share the loaded modules and model weights copy-on-write.
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+if preload_app:
+    os.environ.setdefault('PRELOAD_MODELS', 'true')
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+
+# With more than one thread gunicorn runs gthread workers. A request queued
+# by admission control then waits on one thread while the others keep
+# serving light routes and /healthz, and the cpu/model slots can actually
+# fill up. Size it above the admission capacity divided by the workers.
+threads = int(os.environ.get('GUNICORN_THREADS', max(4, (os.cpu_count() or 2) * 2 // workers + 2)))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+
+
+def on_starting(server):
+    # Per-worker metric files from a previous run would otherwise be summed in.
+    from metrics import metrics
+    metrics.reset()
+
+
+def pre_fork(server, worker):
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Threads don't survive fork(); give the worker its own log listener.
+    from log_pipeline import pipeline
+    pipeline.ensure_listener()
@@ -0,0 +1,366 @@
+"""In-memory image operations shared by the image routes.
+
+Each operation takes and returns decoded Pillow images, so callers decide
+when to decode and encode.
+"""
+import warnings
+
+from PIL import Image, ImageOps
+
+from metrics import stage_timer
+
+# u2net, u2netp and silueta all resize their input to 320x320.
+DEFAULT_MODEL_INPUT_SIZE = 320
+
+# Above this many pixels, 'auto' inference runs on a downsampled copy.
+LOWRES_MIN_PIXELS = 2_000_000
+
+INFERENCE_MODES = ('auto', 'lowres', 'full')
+
+# Bytes Pillow allocates per pixel by mode; multi-band modes (RGB, RGBA,
+# LA, CMYK, YCbCr...) are all stored 4 bytes wide.
+_MODE_BYTES = {'1': 1, 'L': 1, 'P': 1, 'I;16': 2, 'I;16L': 2, 'I;16B': 2, 'I': 4, 'F': 4}
+
+# Masks are applied this many pixels at a time, so the temporaries stay small.
+STRIP_PIXELS = 1_000_000
+
+# Extra bytes per source pixel that background removal needs on top of the
+# decoded image: the RGBA output, the L mask and an EXIF-rotated copy.
+REMOVE_BACKGROUND_WORKING_BPP = 9
+
+
+# Formats Pillow reports for files that are really a base format plus
+# extras: phones and cameras save multi-picture JPEGs as .jpg.
+FORMAT_ALIASES = {'MPO': 'JPEG'}
+
+
+def base_format(fmt):
+    return FORMAT_ALIASES.get(fmt, fmt)
+
+
+class MemoryBudgetError(Exception):
+    """Raised before decoding when an image would not fit the memory budget."""
+
+    def __init__(self, needed, budget):
+        self.needed = needed
+        self.budget = budget
+        super().__init__(
+            f'Image too large to process: needs about {needed // (1024 * 1024)} MB, '
+            f'the limit is {budget // (1024 * 1024)} MB.'
+        )
+
+
+def bytes_per_pixel(mode):
+    return _MODE_BYTES.get(mode, 4)
+
+
+def decoded_size(width, height, mode):
+    """Bytes the decoded pixels of a ``width`` x ``height`` ``mode`` image take."""
+    return width * height * bytes_per_pixel(mode)
+
+
+def open_image(stream, budget=None, working_bpp=0, extra_bytes=0, target_size=None):
+    """Open ``stream`` and decode it, but only if the work fits ``budget`` bytes.
+
+    The estimate comes from the header alone: the decoded image, plus
+    ``working_bpp`` bytes per source pixel and ``extra_bytes`` for the
+    operation's own buffers. When ``target_size`` is given, JPEGs are
+    decoded at the smallest DCT scale that still covers it.
+    """
+    img = Image.open(stream)
+    if target_size and base_format(img.format) == 'JPEG':
+        img.draft(img.mode, target_size)
+    if budget:
+        width, height = img.size
+        needed = decoded_size(width, height, img.mode) + width * height * working_bpp + extra_bytes
+        if needed > budget:
+            img.close()
+            raise MemoryBudgetError(needed, budget)
+    img.load()
+    return img
+
+
+class ProbeError(ValueError):
+    """An upload failed the header probe; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def probe(stream, allowed_formats=None, max_pixels=None):
+    """Read only the header of ``stream`` and check it against policy.
+
+    Returns format, dimensions, frame count, mode and the decoded size
+    without decoding any pixels, and rewinds ``stream`` for the real open.
+    Raises ``ProbeError`` for unrecognized, unsupported or oversized input.
+    """
+    start = stream.tell()
+    try:
+        with warnings.catch_warnings():
+            # The pixel limit below is ours to enforce.
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            img = Image.open(stream)
+    except Image.DecompressionBombError:
+        raise ProbeError('Image has too many pixels to process.', 413)
+    except (Image.UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        raise ProbeError('Could not identify image file. Please ensure it is a valid image.', 400)
+    finally:
+        stream.seek(start)
+
+    try:
+        try:
+            frames = getattr(img, 'n_frames', 1)
+        except (EOFError, OSError):
+            # Truncated input, e.g. a client probing with just the first few KB.
+            frames = None
+        info = {
+            'format': img.format,
+            'width': img.width,
+            'height': img.height,
+            'frames': frames,
+            'mode': img.mode,
+            'decoded_bytes': decoded_size(img.width, img.height, img.mode),
+        }
+    finally:
+        # Not img.close(): that would close the caller's stream too.
+        del img
+        stream.seek(start)
+
+    if allowed_formats is not None and base_format(info['format']) not in allowed_formats:
+        raise ProbeError(f"Unsupported image format {info['format']}. Allowed: {', '.join(sorted(allowed_formats))}", 415)
+    if max_pixels and info['width'] * info['height'] > max_pixels:
+        raise ProbeError(
+            f"Image is {info['width']}x{info['height']}; at most {max_pixels // 1_000_000} megapixels are allowed.", 413)
+    return info
+
+
+def _exif_transpose(img):
+    # ImageOps.exif_transpose copies the whole image even when there is
+    # nothing to rotate.
+    if img.getexif().get(0x0112, 1) in (0, 1):
+        return img
+    return ImageOps.exif_transpose(img)
+
+
+def apply_mask(img, mask):
+    """Return ``img`` as RGBA with ``mask`` as its alpha, built strip by strip.
+
+    Same result as compositing over transparent black: fully transparent
+    pixels become transparent black, which also compresses better than
+    leftover RGB. Only one strip of temporaries exists at a time.
+    """
+    width, height = img.size
+    out = Image.new('RGBA', img.size, 0)
+    rows = max(1, STRIP_PIXELS // max(width, 1))
+    for top in range(0, height, rows):
+        box = (0, top, width, min(top + rows, height))
+        strip = img.crop(box)
+        if strip.mode != 'RGBA':
+            strip = strip.convert('RGBA')
+        out.paste(strip, box[:2], mask.crop(box))
+    return out
+
+
+def remove_background(img, rembg, session, inference='auto', mask_only=False,
+                      input_size=DEFAULT_MODEL_INPUT_SIZE, lowres_min_pixels=LOWRES_MIN_PIXELS):
+    """Cut the background out of ``img``.
+
+    The model only ever sees a ``input_size`` square, so for large photos
+    'lowres' inference downsamples to that size first, runs the model once
+    and upsamples just the alpha mask, which is then applied to the
+    original full-resolution pixels. 'full' hands the whole image to rembg.
+    Returns an RGBA cutout, or the L-mode mask when ``mask_only``.
+    """
+    img = _exif_transpose(img)
+    if inference == 'auto':
+        inference = 'lowres' if img.width * img.height > lowres_min_pixels else 'full'
+
+    if inference == 'lowres':
+        # Resize straight from the source: copying it first would hold a
+        # second full-resolution image just to shrink it.
+        scale = min(input_size / img.width, input_size / img.height, 1.0)
+        small_size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        small = img.resize(small_size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+        with stage_timer('inference'):
+            mask = rembg.remove(small, session=session, only_mask=True)
+        with stage_timer('mask-upsample'):
+            mask = mask.convert('L').resize(img.size, Image.Resampling.BILINEAR)
+    else:
+        with stage_timer('inference'):
+            mask = rembg.remove(img, session=session, only_mask=True).convert('L')
+
+    if mask_only:
+        return mask
+
+    with stage_timer('composite'):
+        return apply_mask(img, mask)
+
+
+ICON_SIZES = [(16, 16), (24, 24), (32, 32), (48, 48), (64, 64), (128, 128), (256, 256)]
+
+# Output format and mimetype by file extension or format name.
+OUTPUT_FORMATS = {
+    'png': ('PNG', 'image/png', '.png'),
+    'jpg': ('JPEG', 'image/jpeg', '.jpg'),
+    'jpeg': ('JPEG', 'image/jpeg', '.jpg'),
+    'gif': ('GIF', 'image/gif', '.gif'),
+    'webp': ('WEBP', 'image/webp', '.webp'),
+    'ico': ('ICO', 'image/x-icon', '.ico'),
+}
+
+
+def resize(img, width, height):
+    return img.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+
+ICO_MAX_SIZE = 256
+
+
+def shrink_for_ico(img):
+    """Downscale ``img`` so its short side is ``ICO_MAX_SIZE``, keeping every icon size valid.
+
+    The ICO encoder copies the full source once per icon size; handing it
+    a small image keeps those copies (and the RGBA conversion) cheap.
+    """
+    short_side = min(img.size)
+    if short_side <= ICO_MAX_SIZE:
+        return img
+    scale = ICO_MAX_SIZE / short_side
+    size = (max(ICO_MAX_SIZE, round(img.width * scale)), max(ICO_MAX_SIZE, round(img.height * scale)))
+    return img.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+
+def ico_sizes(img):
+    """Standard icon sizes that fit inside ``img``, or its own size if it is smaller."""
+    sizes = [size for size in ICON_SIZES if size[0] <= img.width and size[1] <= img.height]
+    return sizes or [(img.width, img.height)]
+
+
+def encode(img, fmt, out, compress_level=None, quality=None):
+    """Encode ``img`` to the file object ``out`` in Pillow format ``fmt``."""
+    options = {}
+    if fmt == 'ICO':
+        img = shrink_for_ico(img)
+        if img.mode != 'RGBA':
+            img = img.convert('RGBA')
+        options['sizes'] = ico_sizes(img)
+    elif fmt == 'JPEG':
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGB')
+        if quality is not None:
+            options['quality'] = quality
+    elif fmt == 'WEBP' and quality is not None:
+        options['quality'] = quality
+    elif fmt == 'PNG' and compress_level is not None:
+        options['compress_level'] = compress_level
+    img.save(out, format=fmt, **options)
+    return out
+
+
+PIPELINE_OPS = ('remove_background', 'resize', 'encode')
+
+MAX_PIPELINE_STEPS = 16
+
+
+class PipelineError(ValueError):
+    pass
+
+
+def _int_field(step, key, low, high, default=None):
+    value = step.get(key, default)
+    if value is None:
+        raise PipelineError(f"'{step['op']}' needs '{key}'.")
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise PipelineError(f"'{step['op']}.{key}' must be an integer.")
+    if not low <= value <= high:
+        raise PipelineError(f"'{step['op']}.{key}' must be between {low} and {high}.")
+    return value
+
+
+def parse_pipeline(operations, max_dimension=8000):
+    """Validate an operations list; return ``(steps, output)``.
+
+    ``steps`` are the normalized image operations in order. ``encode`` may
+    only appear last and becomes ``output`` (defaults to PNG), so the image
+    is encoded exactly once.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise PipelineError('operations must be a non-empty list.')
+    if len(operations) > MAX_PIPELINE_STEPS:
+        raise PipelineError(f'At most {MAX_PIPELINE_STEPS} operations are allowed.')
+
+    steps = []
+    output = {'format': 'png', 'compression': 6, 'quality': None}
+    for index, step in enumerate(operations):
+        if not isinstance(step, dict) or step.get('op') not in PIPELINE_OPS:
+            raise PipelineError(f"Operation {index + 1} must be an object with 'op' one of: {', '.join(PIPELINE_OPS)}.")
+        op = step['op']
+        if op == 'encode':
+            if index != len(operations) - 1:
+                raise PipelineError("'encode' must be the last operation.")
+            fmt = str(step.get('format', 'png')).lower().lstrip('.')
+            if fmt not in OUTPUT_FORMATS:
+                raise PipelineError(f"Unsupported output format '{fmt}'. Choose from: {', '.join(OUTPUT_FORMATS)}.")
+            output = {
+                'format': fmt,
+                'compression': _int_field(step, 'compression', 0, 9, default=6),
+                'quality': _int_field(step, 'quality', 1, 100) if 'quality' in step else None,
+            }
+        elif op == 'resize':
+            steps.append({
+                'op': op,
+                'width': _int_field(step, 'width', 1, max_dimension),
+                'height': _int_field(step, 'height', 1, max_dimension),
+            })
+        elif op == 'remove_background':
+            inference = str(step.get('inference', 'auto')).lower()
+            if inference not in INFERENCE_MODES:
+                raise PipelineError(f"Invalid inference mode. Choose from: {', '.join(INFERENCE_MODES)}")
+            output_mode = str(step.get('output', 'image')).lower()
+            if output_mode not in ('image', 'mask'):
+                raise PipelineError("Invalid remove_background output. Choose image or mask.")
+            tier = step.get('tier')
+            steps.append({
+                'op': op,
+                'tier': str(tier).strip().lower() if tier else None,
+                'inference': inference,
+                'mask_only': output_mode == 'mask',
+            })
+    return steps, output
+
+
+def pipeline_footprint(steps, output):
+    """``open_image`` keyword arguments estimating the memory ``steps`` need."""
+    footprint = {'working_bpp': 0, 'extra_bytes': 0, 'target_size': None}
+    for step in steps:
+        if step['op'] == 'remove_background':
+            footprint['working_bpp'] = REMOVE_BACKGROUND_WORKING_BPP
+        elif step['op'] == 'resize':
+            footprint['extra_bytes'] += 2 * decoded_size(step['width'], step['height'], 'RGBA')
+    # Decoding at reduced scale is only safe when nothing needs the full
+    # resolution first.
+    if steps and steps[0]['op'] == 'resize':
+        footprint['target_size'] = (steps[0]['width'], steps[0]['height'])
+    elif not steps and output['format'] == 'ico':
+        footprint['target_size'] = (ICO_MAX_SIZE, ICO_MAX_SIZE)
+    return footprint
+
+
+def run_pipeline(img, steps, rembg=None):
+    """Apply ``steps`` to ``img`` in memory and return the resulting image.
+
+    ``remove_background`` steps must carry the model ``session`` to use.
+    """
+    for step in steps:
+        with stage_timer(step['op']):
+            if step['op'] == 'resize':
+                img = resize(img, step['width'], step['height'])
+            elif step['op'] == 'remove_background':
+                img = remove_background(
+                    img, rembg, step['session'],
+                    inference=step['inference'], mask_only=step['mask_only'],
+                )
+    return img
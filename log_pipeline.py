@@ -0,0 +1,203 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+import zlib
+
+from flask import g, has_request_context, request
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+# Attributes every LogRecord has; anything else was passed through ``extra``
+# and ends up as a structured field.
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id'}
+
+_IMMUTABLE_ARG_TYPES = (str, int, float, bool, bytes, type(None))
+
+
+def current_request_id():
+    if has_request_context():
+        return g.get('request_id', '-')
+    return '-'
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the correlation id of the request that emitted them."""
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = current_request_id()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of DEBUG/INFO records; WARNING and above always pass.
+
+    Sampling is keyed on the request id, so a sampled request keeps all of
+    its lines and the rest of the log stays readable.
+    """
+
+    def __init__(self, info_rate=1.0, debug_rate=1.0):
+        super().__init__()
+        self.rates = {logging.DEBUG: debug_rate, logging.INFO: info_rate}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.levelno, 1.0)
+        if rate >= 1.0:
+            return True
+        if rate <= 0.0:
+            return False
+        request_id = getattr(record, 'request_id', '-')
+        if request_id != '-':
+            bucket = zlib.crc32(f"{request_id}:{record.levelno}".encode()) / 0xFFFFFFFF
+            return bucket < rate
+        return random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', '-'),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_text:
+            payload['exc'] = record.exc_text
+        elif record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            payload['stack'] = record.stack_info
+        return json.dumps(payload, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('[%(levelname)s] [%(request_id)s] %(message)s')
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that defers message formatting to the listener thread.
+
+    The stock handler renders ``msg % args`` on the calling thread. Here
+    records whose args are all immutable are queued as-is, so the request
+    thread only pays for building the record. Records with mutable args are
+    rendered up front, since the objects could change before the listener
+    gets to them. When the queue is full records are dropped rather than
+    blocking the request.
+    """
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        if record.args and not all(isinstance(a, _IMMUTABLE_ARG_TYPES) for a in _iter_args(record.args)):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _iter_args(args):
+    if isinstance(args, dict):
+        return args.values()
+    return args
+
+
+class LogPipeline:
+    """Asynchronous, sampled logging shared by the whole app.
+
+    Log calls only enqueue a record; formatting and writing to stderr happen
+    on a background listener thread. The listener is (re)started per
+    process so forked gunicorn workers get their own.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=int(os.environ.get('LOG_QUEUE_SIZE', 10000)))
+        self.handler = LazyQueueHandler(self.queue)
+        self.listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def configure(self, level=None, fmt=None, info_rate=None, debug_rate=None):
+        level = level or os.environ.get('LOG_LEVEL', 'INFO')
+        fmt = fmt or os.environ.get('LOG_FORMAT', 'text')
+        info_rate = float(os.environ.get('LOG_SAMPLE_RATE', 1.0)) if info_rate is None else info_rate
+        debug_rate = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 0.01)) if debug_rate is None else debug_rate
+
+        self.stream_handler = logging.StreamHandler(sys.stderr)
+        self.stream_handler.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+
+        self.handler.filters = []
+        self.handler.addFilter(RequestContextFilter())
+        self.handler.addFilter(SamplingFilter(info_rate=info_rate, debug_rate=debug_rate))
+
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(self.handler)
+        root.setLevel(level)
+        self.ensure_listener()
+
+    def ensure_listener(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            if self._pid is not None:
+                # Forked from a process with a running listener: its queue
+                # lock may have been held mid-fork, so start from a new one.
+                self.queue = queue.Queue(maxsize=self.queue.maxsize)
+                self.handler.queue = self.queue
+            self.listener = logging.handlers.QueueListener(self.queue, self.stream_handler, respect_handler_level=True)
+            self.listener.start()
+            self._pid = pid
+
+    def stop(self):
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+            self._pid = None
+
+    def init_app(self, app):
+        @app.before_request
+        def _assign_request_id():
+            self.ensure_listener()
+            supplied = request.headers.get(REQUEST_ID_HEADER, '')
+            g.request_id = supplied if REQUEST_ID_RE.match(supplied) else uuid.uuid4().hex[:16]
+
+        @app.after_request
+        def _return_request_id(response):
+            request_id = g.get('request_id')
+            if request_id:
+                response.headers[REQUEST_ID_HEADER] = request_id
+            return response
+
+
+pipeline = LogPipeline()
+atexit.register(pipeline.stop)
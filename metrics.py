@@ -0,0 +1,400 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+DEFAULT_METRICS_DIR = os.path.join(tempfile.gettempdir(), 'benpdf-metrics')
+
+# Counters of exited workers, folded together so the directory doesn't grow
+# with every worker that ever ran.
+RETIRED_NAME = 'metrics-retired.json'
+
+LOCK_NAME = '.metrics.lock'
+
+SECTIONS = ('requests', 'latency', 'stages', 'bytes_in', 'bytes_out', 'in_flight')
+
+
+def _label_key(*labels):
+    return '\x1f'.join(str(l) for l in labels)
+
+
+def _split_key(key):
+    return key.split('\x1f')
+
+
+class Metrics:
+    """Per-process request metrics aggregated across gunicorn workers.
+
+    Every process keeps its own counters and periodically writes them to
+    ``<metrics_dir>/metrics-<pid>.json``. A scrape of ``/metrics`` on any
+    worker merges all files, so the result covers the whole server no
+    matter which worker answers. Counters of exited workers are kept:
+    each process, when it first writes and on every scrape, folds the files
+    of dead pids into ``metrics-retired.json``, so the directory stays
+    small and a new process that reuses a pid doesn't overwrite the old
+    one's counts. In-flight gauges only count processes that are alive.
+    """
+
+    def __init__(self, metrics_dir=None, flush_interval=1.0):
+        self.metrics_dir = metrics_dir or os.environ.get('METRICS_DIR', DEFAULT_METRICS_DIR)
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._last_flush = 0.0
+        self._flushed_in_flight = 0
+        self._claimed = False
+        self._reset_state()
+        self.collectors = []
+        os.makedirs(self.metrics_dir, exist_ok=True)
+
+    def _reset_state(self):
+        self.requests = {}
+        self.latency = {}
+        self.stages = {}
+        self.bytes_in = {}
+        self.bytes_out = {}
+        self.in_flight = {}
+
+    def _check_fork(self):
+        # A forked worker inherits the parent's numbers; start from zero so
+        # they are not counted twice.
+        pid = os.getpid()
+        if pid != self._pid:
+            self._pid = pid
+            self._last_flush = 0.0
+            self._flushed_in_flight = 0
+            self._claimed = False
+            self._reset_state()
+
+    @staticmethod
+    def _observe(hist, key, value):
+        entry = hist.get(key)
+        if entry is None:
+            entry = hist[key] = {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                entry['buckets'][i] += 1
+        entry['sum'] += value
+        entry['count'] += 1
+
+    def request_started(self, route):
+        with self._lock:
+            self._check_fork()
+            self.in_flight[route] = self.in_flight.get(route, 0) + 1
+        self._maybe_flush()
+
+    def request_finished(self, route, method, status, duration, bytes_in, bytes_out):
+        with self._lock:
+            self._check_fork()
+            self.in_flight[route] = max(self.in_flight.get(route, 1) - 1, 0)
+            key = _label_key(route, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self._observe(self.latency, route, duration)
+            self.bytes_in[route] = self.bytes_in.get(route, 0) + bytes_in
+            self.bytes_out[route] = self.bytes_out.get(route, 0) + bytes_out
+        self._maybe_flush(idle_check=True)
+
+    def observe_stage(self, route, stage, duration):
+        with self._lock:
+            self._check_fork()
+            self._observe(self.stages, _label_key(route, stage), duration)
+
+    def _snapshot(self):
+        return {
+            'requests': self.requests,
+            'latency': self.latency,
+            'stages': self.stages,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'in_flight': self.in_flight,
+        }
+
+    def _maybe_flush(self, idle_check=False):
+        now = time.monotonic()
+        if now - self._last_flush >= self.flush_interval:
+            self.flush()
+        elif idle_check and self._flushed_in_flight and not any(self.in_flight.values()):
+            # Don't leave a non-zero in-flight gauge on disk while the worker idles.
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._check_fork()
+            data = json.dumps(self._snapshot())
+            in_flight = sum(self.in_flight.values())
+            self._last_flush = time.monotonic()
+            if not self._claimed:
+                # First write from this process: a file under our pid is
+                # left over from an exited process that had the same pid.
+                self._claimed = True
+                self.prune(include_own=True)
+        path = os.path.join(self.metrics_dir, f"metrics-{self._pid}.json")
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._flushed_in_flight = in_flight
+        except OSError as e:
+            logger.warning("Could not write metrics file %s: %s", path, e)
+
+    def reset(self):
+        """Remove all worker files, e.g. when the server (re)starts."""
+        with self._lock:
+            self._reset_state()
+        try:
+            for name in os.listdir(self.metrics_dir):
+                if name.startswith('metrics-'):
+                    os.remove(os.path.join(self.metrics_dir, name))
+        except OSError as e:
+            logger.warning("Could not reset metrics dir %s: %s", self.metrics_dir, e)
+
+    @staticmethod
+    def _pid_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        except OSError:
+            return False
+        return True
+
+    @staticmethod
+    def _merge(merged, data, in_flight=True):
+        for section in ('requests', 'bytes_in', 'bytes_out'):
+            for key, value in data.get(section, {}).items():
+                merged[section][key] = merged[section].get(key, 0) + value
+        if in_flight:
+            for key, value in data.get('in_flight', {}).items():
+                merged['in_flight'][key] = merged['in_flight'].get(key, 0) + value
+        for section in ('latency', 'stages'):
+            for key, entry in data.get(section, {}).items():
+                target = merged[section].get(key)
+                if target is None:
+                    merged[section][key] = {'buckets': list(entry['buckets']), 'sum': entry['sum'], 'count': entry['count']}
+                else:
+                    target['buckets'] = [a + b for a, b in zip(target['buckets'], entry['buckets'])]
+                    target['sum'] += entry['sum']
+                    target['count'] += entry['count']
+
+    def _worker_files(self):
+        """``(name, pid)`` for every per-process file in the metrics dir."""
+        try:
+            names = os.listdir(self.metrics_dir)
+        except OSError:
+            return []
+        files = []
+        for name in names:
+            if not (name.startswith('metrics-') and name.endswith('.json')):
+                continue
+            try:
+                files.append((name, int(name[len('metrics-'):-len('.json')])))
+            except ValueError:
+                continue
+        return files
+
+    @contextmanager
+    def _dir_lock(self, exclusive):
+        """Keep a scrape from reading the directory halfway through a fold."""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.metrics_dir, LOCK_NAME), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load(self, name):
+        try:
+            with open(os.path.join(self.metrics_dir, name)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (ValueError, OSError) as e:
+            logger.warning("Ignoring unreadable metrics file %s: %s", name, e)
+            return {}
+
+    def prune(self, include_own=False):
+        """Fold the files of exited processes into the retired file."""
+        stale = [name for name, pid in self._worker_files()
+                 if (include_own if pid == self._pid else not self._pid_alive(pid))]
+        if not stale:
+            return 0
+        with self._dir_lock(exclusive=True):
+            retired = {section: {} for section in SECTIONS}
+            self._merge(retired, self._load(RETIRED_NAME) or {}, in_flight=False)
+            folded = []
+            for name in stale:
+                data = self._load(name)
+                if data is None:
+                    # Another process folded it first.
+                    continue
+                self._merge(retired, data, in_flight=False)
+                folded.append(name)
+            if not folded:
+                return 0
+            path = os.path.join(self.metrics_dir, RETIRED_NAME)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(retired, f)
+                os.replace(tmp_path, path)
+                for name in folded:
+                    os.remove(os.path.join(self.metrics_dir, name))
+            except OSError as e:
+                logger.warning("Could not fold metrics files into %s: %s", path, e)
+                return 0
+        return len(folded)
+
+    def collect(self):
+        """Merge the files of all workers into one snapshot."""
+        self.flush()
+        self.prune()
+        merged = {section: {} for section in SECTIONS}
+        with self._dir_lock(exclusive=False):
+            data = self._load(RETIRED_NAME)
+            if data:
+                self._merge(merged, data, in_flight=False)
+            for name, pid in self._worker_files():
+                data = self._load(name)
+                if data:
+                    self._merge(merged, data, in_flight=self._pid_alive(pid))
+        return merged
+
+    def render_prometheus(self):
+        data = self.collect()
+        lines = []
+
+        def esc(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        def hist_lines(name, section, label_names):
+            for key in sorted(data[section]):
+                entry = data[section][key]
+                labels = ','.join(f'{n}="{esc(v)}"' for n, v in zip(label_names, _split_key(key)))
+                for bound, count in zip(LATENCY_BUCKETS, entry['buckets']):
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {entry["count"]}')
+                lines.append(f'{name}_sum{{{labels}}} {entry["sum"]}')
+                lines.append(f'{name}_count{{{labels}}} {entry["count"]}')
+
+        lines.append('# HELP benpdf_http_requests_total Requests handled, by route, method and status.')
+        lines.append('# TYPE benpdf_http_requests_total counter')
+        for key in sorted(data['requests']):
+            route, method, status = _split_key(key)
+            lines.append(f'benpdf_http_requests_total{{route="{esc(route)}",method="{method}",status="{status}"}} {data["requests"][key]}')
+
+        lines.append('# HELP benpdf_http_request_duration_seconds Request latency by route.')
+        lines.append('# TYPE benpdf_http_request_duration_seconds histogram')
+        hist_lines('benpdf_http_request_duration_seconds', 'latency', ('route',))
+
+        lines.append('# HELP benpdf_http_requests_in_flight Requests currently being handled.')
+        lines.append('# TYPE benpdf_http_requests_in_flight gauge')
+        for route in sorted(data['in_flight']):
+            lines.append(f'benpdf_http_requests_in_flight{{route="{esc(route)}"}} {data["in_flight"][route]}')
+
+        for section, name, help_text in (
+            ('bytes_in', 'benpdf_http_request_bytes_total', 'Request body bytes received.'),
+            ('bytes_out', 'benpdf_http_response_bytes_total', 'Response body bytes sent.'),
+        ):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for route in sorted(data[section]):
+                lines.append(f'{name}{{route="{esc(route)}"}} {data[section][route]}')
+
+        lines.append('# HELP benpdf_stage_duration_seconds Time spent in named stages inside handlers.')
+        lines.append('# TYPE benpdf_stage_duration_seconds histogram')
+        hist_lines('benpdf_stage_duration_seconds', 'stages', ('route', 'stage'))
+
+        for collector in self.collectors:
+            try:
+                lines.extend(collector())
+            except Exception:
+                logger.exception("Metrics collector %r failed", collector)
+
+        return '\n'.join(lines) + '\n'
+
+    def register_collector(self, collector):
+        """Add a callable returning extra exposition lines, read at scrape time."""
+        self.collectors.append(collector)
+
+
+metrics = Metrics()
+
+
+def _current_route():
+    try:
+        rule = request.url_rule
+    except RuntimeError:
+        return '-'
+    return rule.rule if rule is not None else 'unmatched'
+
+
+@contextmanager
+def stage_timer(name):
+    """Time a named stage (decode/process/encode/model-load...) of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe_stage(_current_route(), name, time.perf_counter() - start)
+
+
+def init_app(app):
+    """Register request hooks and the ``/metrics`` endpoint on ``app``."""
+    # Files left by the processes of an earlier run, whatever served it.
+    metrics.prune()
+
+    @app.before_request
+    def _metrics_before_request():
+        g.metrics_start = time.perf_counter()
+        g.metrics_route = _current_route()
+        g.metrics_done = False
+        metrics.request_started(g.metrics_route)
+
+    @app.after_request
+    def _metrics_after_request(response):
+        if getattr(g, 'metrics_start', None) is not None and not g.metrics_done:
+            g.metrics_done = True
+            bytes_out = response.content_length
+            if bytes_out is None and not response.is_streamed:
+                bytes_out = response.calculate_content_length()
+            metrics.request_finished(
+                g.metrics_route, request.method, response.status_code,
+                time.perf_counter() - g.metrics_start,
+                request.content_length or 0, bytes_out or 0,
+            )
+        return response
+
+    @app.teardown_request
+    def _metrics_teardown_request(exc):
+        # Requests that raised never reach after_request.
+        if getattr(g, 'metrics_start', None) is not None and not g.metrics_done:
+            g.metrics_done = True
+            metrics.request_finished(
+                g.metrics_route, request.method, 500,
+                time.perf_counter() - g.metrics_start,
+                request.content_length or 0, 0,
+            )
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        return app.response_class(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,181 @@
+import gc
+import logging
+import os
+import sys
+import threading
+
+from metrics import stage_timer
+from tools import tool_registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = 'u2net'
+
+
+def u2net_home():
+    """Directory rembg downloads its models to."""
+    return os.path.expanduser(os.getenv('U2NET_HOME', os.path.join(os.getenv('XDG_DATA_HOME', '~'), '.u2net')))
+
+
+# Request-level latency/quality tiers for background removal, fastest last.
+# 'int8' is a dynamically quantized u2net (see ``quantize_model``) and is only
+# offered when its model file exists.
+MODEL_TIERS = {
+    'quality': {'model': 'u2net'},
+    'balanced': {'model': 'silueta'},
+    'fast': {'model': 'u2netp'},
+    'int8': {
+        'model': 'u2net_custom',
+        'model_path': os.environ.get('REMBG_INT8_MODEL_PATH') or os.path.join(u2net_home(), 'u2net_int8.onnx'),
+    },
+}
+
+DEFAULT_TIER = os.environ.get('REMBG_DEFAULT_TIER', 'quality')
+
+
+class UnknownTierError(ValueError):
+    pass
+
+
+class TierUnavailableError(RuntimeError):
+    pass
+
+
+class ModelStore:
+    """Process-wide cache of rembg sessions, one per tier.
+
+    ``rembg.remove`` builds a new ONNX session on every call when none is
+    passed in, so handlers ask the store for a session instead. In preload
+    mode the sessions are created in the gunicorn master before it forks and
+    the workers share the model weights copy-on-write.
+    """
+
+    def __init__(self, tiers=None):
+        self.tiers = tiers if tiers is not None else MODEL_TIERS
+        self.sessions = {}
+        self._lock = threading.Lock()
+
+    def tier_available(self, tier):
+        spec = self.tiers.get(tier)
+        if spec is None:
+            return False
+        model_path = spec.get('model_path')
+        return model_path is None or os.path.exists(model_path)
+
+    def available_tiers(self):
+        return [name for name in self.tiers if self.tier_available(name)]
+
+    def _session_options(self):
+        import onnxruntime as ort
+        sess_opts = ort.SessionOptions()
+        sess_opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if 'OMP_NUM_THREADS' in os.environ:
+            threads = int(os.environ['OMP_NUM_THREADS'])
+            sess_opts.inter_op_num_threads = threads
+            sess_opts.intra_op_num_threads = threads
+        return sess_opts
+
+    def _new_session(self, model_name, **kwargs):
+        rembg = tool_registry.load('rembg')
+        try:
+            from rembg.sessions import sessions_class
+        except ImportError:
+            sessions_class = None
+        if sessions_class is not None:
+            for session_class in sessions_class:
+                if session_class.name() == model_name:
+                    return session_class(model_name, self._session_options(), **kwargs)
+        # Older/newer rembg layouts: fall back to its factory and defaults.
+        return rembg.new_session(model_name, **kwargs)
+
+    def get_session(self, tier=None):
+        """Return ``(session, tier)`` for ``tier`` (default ``DEFAULT_TIER``)."""
+        tier = tier or DEFAULT_TIER
+        session = self.sessions.get(tier)
+        if session is not None:
+            return session, tier
+        spec = self.tiers.get(tier)
+        if spec is None:
+            raise UnknownTierError(tier)
+        if not self.tier_available(tier):
+            raise TierUnavailableError(tier)
+        with self._lock:
+            session = self.sessions.get(tier)
+            if session is None:
+                kwargs = {k: v for k, v in spec.items() if k != 'model'}
+                with stage_timer('model-load'):
+                    session = self._new_session(spec['model'], **kwargs)
+                self.sessions[tier] = session
+                logger.info("Loaded rembg model %s for tier %s", spec['model'], tier)
+        return session, tier
+
+    def model_name(self, tier):
+        return self.tiers[tier]['model']
+
+
+model_store = ModelStore()
+
+
+def quantize_model(src_path, dst_path):
+    """Write a dynamically int8-quantized copy of the ONNX model at ``src_path``."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(src_path, dst_path, weight_type=QuantType.QUInt8)
+    return dst_path
+
+
+def _warm_sympy():
+    # Populate SymPy's caches with the parser and the common operations so
+    # that state is built once in the master instead of once per worker.
+    sp = tool_registry.load('sympy')
+    x = sp.Symbol('x')
+    local_dict = {'x': x, 'sin': sp.sin, 'cos': sp.cos, 'exp': sp.exp, 'log': sp.log}
+    expr = sp.parse_expr('sin(x)*x^2 + exp(x)', local_dict=local_dict, transformations=sp.transformations)
+    sp.latex(sp.diff(expr, x).simplify())
+    sp.latex(sp.integrate(sp.expand(expr), x))
+
+
+def preload(tools=None, tiers=None):
+    """Load tools and model tiers up front, typically in the gunicorn master.
+
+    ONNX Runtime worker threads do not survive ``fork()``, so unless
+    ``OMP_NUM_THREADS`` is already set, sessions created here are limited to
+    the calling thread. Each gunicorn worker is a separate process, so
+    parallelism comes from the worker count instead.
+    """
+    os.environ.setdefault('OMP_NUM_THREADS', '1')
+    tools = tools if tools is not None else ['sympy', 'qrcode', 'requests', 'pymupdf', 'rembg']
+    tiers = tiers if tiers is not None else [DEFAULT_TIER]
+
+    for name in tools:
+        if not tool_registry.available(name):
+            logger.info("Skipping preload of %s: not installed", name)
+            continue
+        try:
+            tool_registry.load(name)
+        except Exception:
+            logger.exception("Failed to preload tool %s", name)
+    if 'sympy' in tools and tool_registry.available('sympy'):
+        _warm_sympy()
+    if tool_registry.available('rembg'):
+        for tier in tiers:
+            try:
+                model_store.get_session(tier)
+            except Exception:
+                logger.exception("Failed to preload rembg tier %s", tier)
+
+    # Move everything allocated so far out of the GC's reach, so collections
+    # in the workers don't write to (and un-share) these pages.
+    gc.collect()
+    gc.freeze()
+
+
+if __name__ == '__main__':
+    # python models.py quantize [src.onnx] [dst.onnx]
+    if len(sys.argv) >= 2 and sys.argv[1] == 'quantize':
+        src = sys.argv[2] if len(sys.argv) > 2 else os.path.join(u2net_home(), 'u2net.onnx')
+        dst = sys.argv[3] if len(sys.argv) > 3 else MODEL_TIERS['int8']['model_path']
+        quantize_model(src, dst)
+        print(f"Wrote {dst}")
+    else:
+        print("usage: python models.py quantize [src.onnx] [dst.onnx]")
+        sys.exit(2)
@@ -0,0 +1,177 @@
+"""PDF operations shared by the ``/api/pdf`` routes.
+
+Everything works on files on disk: MuPDF opened by path reads objects from
+the file as pages need them, so large inputs are never copied into memory
+whole. Each operation takes the loaded ``pymupdf`` module, like
+``image_ops`` takes ``rembg``.
+"""
+import os
+import re
+import zipfile
+
+from metrics import stage_timer
+
+MAX_MERGE_FILES = 50
+
+# Drop unused objects, compress uncompressed streams and pack small objects
+# into object streams.
+SAVE_OPTIONS = {'garbage': 3, 'deflate': True, 'use_objstms': 1}
+
+COMPRESS_OPTIONS = {
+    'garbage': 4, 'clean': True, 'deflate': True, 'deflate_images': True, 'deflate_fonts': True, 'use_objstms': 1,
+}
+
+_RANGE_RE = re.compile(r'^(\d*)\s*(?:(-)\s*(\d*))?$')
+
+
+class PdfError(ValueError):
+    pass
+
+
+def open_pdf(pymupdf, path):
+    try:
+        doc = pymupdf.open(path, filetype='pdf')
+    except Exception as e:
+        raise PdfError('Could not open PDF. Please ensure it is a valid PDF file.') from e
+    if doc.needs_pass:
+        doc.close()
+        raise PdfError('Password-protected PDFs are not supported.')
+    return doc
+
+
+def parse_page_ranges(spec, page_count):
+    """Parse ``"1-3,5,8-"`` (1-based, inclusive) into 0-based ``(first, last)`` pairs."""
+    ranges = []
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        match = _RANGE_RE.match(part)
+        if not match or not (match.group(1) or match.group(3)):
+            raise PdfError(f"Invalid page range '{part}'. Use e.g. 1-3,5,8-")
+        start = int(match.group(1)) if match.group(1) else 1
+        if match.group(2):
+            end = int(match.group(3)) if match.group(3) else page_count
+        else:
+            end = start
+        if not 1 <= start <= end <= page_count:
+            raise PdfError(f"Page range '{part}' is outside 1-{page_count}.")
+        ranges.append((start - 1, end - 1))
+    if not ranges:
+        raise PdfError('No pages selected.')
+    return ranges
+
+
+def chunk_ranges(page_count, every):
+    """Consecutive ``(first, last)`` ranges of ``every`` pages covering the document."""
+    return [(start, min(start + every, page_count) - 1) for start in range(0, page_count, every)]
+
+
+def merge(pymupdf, base_path, other_paths):
+    """Append ``other_paths`` to the PDF at ``base_path``, in place.
+
+    The pages of the base file are not rewritten: the new objects are
+    appended with an incremental save, so merging onto a large document
+    costs about as much as the documents being added.
+    """
+    doc = open_pdf(pymupdf, base_path)
+    rewritten = None
+    try:
+        for path in other_paths:
+            src = open_pdf(pymupdf, path)
+            try:
+                with stage_timer('insert'):
+                    doc.insert_pdf(src)
+            finally:
+                src.close()
+        with stage_timer('save'):
+            if doc.can_save_incrementally():
+                doc.saveIncr()
+            else:
+                # Repaired files can't be appended to; rewrite them instead.
+                rewritten = f"{base_path}.tmp"
+                doc.save(rewritten, **SAVE_OPTIONS)
+    finally:
+        doc.close()
+    if rewritten is not None:
+        os.replace(rewritten, base_path)
+    return base_path
+
+
+def extract(pymupdf, path, out_path, ranges):
+    """Write the pages in ``ranges`` of ``path``, in that order, to ``out_path``."""
+    doc = open_pdf(pymupdf, path)
+    try:
+        doc.select([page for first, last in ranges for page in range(first, last + 1)])
+        with stage_timer('save'):
+            doc.save(out_path, **SAVE_OPTIONS)
+    finally:
+        doc.close()
+    return out_path
+
+
+def split(pymupdf, path, ranges, stem='document'):
+    """Yield ``(filename, pdf_bytes)`` for each of ``ranges``, one part at a time."""
+    doc = open_pdf(pymupdf, path)
+    try:
+        for first, last in ranges:
+            part = pymupdf.open()
+            try:
+                part.insert_pdf(doc, from_page=first, to_page=last)
+                pages = f'{first + 1}' if first == last else f'{first + 1}-{last + 1}'
+                yield f'{stem}_pages_{pages}.pdf', part.tobytes(**SAVE_OPTIONS)
+            finally:
+                part.close()
+    finally:
+        doc.close()
+
+
+def compress(pymupdf, path, out_path, image_dpi=None, image_quality=75):
+    """Rewrite ``path`` to ``out_path`` with unused objects dropped and streams compressed.
+
+    With ``image_dpi``, images above 1.5x that resolution are also
+    downsampled to it and recompressed at ``image_quality``.
+    """
+    doc = open_pdf(pymupdf, path)
+    try:
+        if image_dpi:
+            with stage_timer('images'):
+                doc.rewrite_images(dpi_threshold=int(image_dpi * 1.5), dpi_target=image_dpi, quality=image_quality)
+        with stage_timer('save'):
+            doc.save(out_path, **COMPRESS_OPTIONS)
+    finally:
+        doc.close()
+    return out_path
+
+
+class _ChunkSink:
+    """Write-only file object that collects what ``zipfile`` writes, for streaming."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(members):
+    """Yield a ZIP archive of ``(filename, data)`` members as it is built.
+
+    Parts are stored rather than deflated: PDF streams are compressed
+    already. Only one member is held in memory at a time.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as zf:
+        for name, data in members:
+            zf.writestr(name, data)
+            yield sink.drain()
+    yield sink.drain()
@@ -0,0 +1,223 @@
+import cProfile
+import hmac
+import logging
+import os
+import pstats
+import random
+import tempfile
+import threading
+import tracemalloc
+import uuid
+
+from flask import abort, g, request, send_file
+
+from storage import StorageManager
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+
+PROFILE_FILES = {
+    'pstats': ('prof', 'application/octet-stream'),
+    'folded': ('folded', 'text/plain'),
+    'alloc': ('alloc', 'text/plain'),
+}
+
+TRACEMALLOC_FRAMES = 25
+TOP_ALLOCATIONS = 30
+
+
+def _func_label(func):
+    filename, lineno, name = func
+    if filename == '~':
+        return name
+    return f"{name} ({os.path.basename(filename)}:{lineno})"
+
+
+def collapsed_stacks(stats, min_fraction=0.0005, max_depth=200):
+    """Rebuild flamegraph-style collapsed stacks from a cProfile call graph.
+
+    cProfile only records caller/callee edges, so the stacks are
+    reconstructed by walking the graph from its roots and splitting each
+    function's time across call paths in proportion to the edge times.
+    Values are microseconds of self time. Paths carrying less than
+    ``min_fraction`` of the total time are dropped, which keeps the walk
+    bounded on large call graphs.
+    """
+    raw = stats.stats
+    callees = {}
+    for func, (cc, nc, tt, ct, callers) in raw.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    roots = [func for func, entry in raw.items() if not entry[4]]
+    min_time = sum(raw[root][3] for root in roots) * min_fraction
+
+    totals = {}
+
+    def walk(func, path, cumulative):
+        entry = raw.get(func)
+        if entry is None or entry[3] <= 0 or cumulative < min_time or len(path) >= max_depth:
+            return
+        scale = min(cumulative / entry[3], 1.0)
+        stack = path + (_func_label(func),)
+        self_time = entry[2] * scale
+        if self_time > 0:
+            key = ';'.join(stack)
+            totals[key] = totals.get(key, 0.0) + self_time
+        for child, edge_ct in callees.get(func, []):
+            if child in path_funcs:
+                continue
+            path_funcs.add(child)
+            walk(child, stack, edge_ct * scale)
+            path_funcs.discard(child)
+
+    for root in roots:
+        path_funcs = {root}
+        walk(root, (), raw[root][3])
+
+    return '\n'.join(f"{stack} {int(seconds * 1e6)}" for stack, seconds in sorted(totals.items())
+                     if int(seconds * 1e6) > 0) + '\n'
+
+
+class RequestProfiler:
+    """Wrap selected requests with cProfile and, on request, tracemalloc.
+
+    A request is profiled when it carries ``PROFILE_TOKEN`` in the
+    ``X-Profile`` header, or when it is picked by ``PROFILE_SAMPLE_RATE``.
+    At most one request per process is profiled at a time. cProfile only
+    traces the thread that enabled it, so a sampled request runs a few
+    times slower but its neighbours don't; a low rate can stay on in
+    production. tracemalloc hooks every allocation in the process, slowing
+    all threads while it runs, so allocation tracing is only done for
+    token-authenticated requests. Results are written by a background
+    thread, so they don't hold up the response.
+    """
+
+    def __init__(self, token=None, sample_rate=0.0, profile_dir=None, ttl=24 * 3600,
+                 quota_bytes=256 * 1024 * 1024):
+        self.token = token
+        self.sample_rate = sample_rate
+        self.storage = StorageManager(
+            profile_dir or os.path.join(tempfile.gettempdir(), 'benpdf-profiles'),
+            default_ttl=ttl,
+            quota_bytes=quota_bytes,
+        )
+        self._busy = threading.Lock()
+
+    def authorized(self, supplied):
+        return bool(self.token) and bool(supplied) and hmac.compare_digest(supplied, self.token)
+
+    def _requested(self):
+        """Return ``(profile, trace_allocations)`` for the current request."""
+        supplied = request.headers.get(PROFILE_HEADER)
+        if supplied:
+            authorized = self.authorized(supplied)
+            return authorized, authorized
+        return self.sample_rate > 0 and random.random() < self.sample_rate, False
+
+    def start(self):
+        self.storage.ensure_janitor()
+        profile, trace_allocations = self._requested()
+        if not profile:
+            return
+        if not self._busy.acquire(blocking=False):
+            logger.info("Skipping profile of %s: another request is being profiled", request.path)
+            return
+        started_tracemalloc = False
+        if trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            started_tracemalloc = True
+        profiler = cProfile.Profile()
+        g.profile = {
+            'id': uuid.uuid4().hex,
+            'profiler': profiler,
+            'trace_allocations': trace_allocations,
+            'started_tracemalloc': started_tracemalloc,
+            'path': request.path,
+        }
+        profiler.enable()
+
+    def stop(self, response=None):
+        ctx = g.pop('profile', None)
+        if ctx is None:
+            return response
+        try:
+            ctx['profiler'].disable()
+            snapshot = tracemalloc.take_snapshot() if ctx['trace_allocations'] else None
+            if ctx['started_tracemalloc']:
+                tracemalloc.stop()
+        finally:
+            self._busy.release()
+        if response is not None:
+            response.headers['X-Profile-Id'] = ctx['id']
+        # Not response.call_on_close: send_file responses go to the server
+        # directly and are never closed, and those are the slow routes.
+        threading.Thread(target=self._write, args=(ctx, snapshot),
+                         name=f"profile-writer-{ctx['id'][:8]}", daemon=True).start()
+        return response
+
+    def _file_path(self, profile_id, kind):
+        return os.path.join(self.storage.root, f"{profile_id}.{PROFILE_FILES[kind][0]}")
+
+    def _write(self, ctx, snapshot):
+        profile_id = ctx['id']
+        try:
+            stats = pstats.Stats(ctx['profiler'])
+            stats.dump_stats(self._file_path(profile_id, 'pstats'))
+
+            with open(self._file_path(profile_id, 'folded'), 'w') as f:
+                f.write(collapsed_stacks(stats))
+
+            kinds = ['pstats', 'folded']
+            if snapshot is not None:
+                snapshot = snapshot.filter_traces((
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                ))
+                with open(self._file_path(profile_id, 'alloc'), 'w') as f:
+                    f.write(f"Top {TOP_ALLOCATIONS} allocation sites for {ctx['path']}\n\n")
+                    for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+                        f.write(f"{stat}\n")
+                    f.write(f"\nTop {TOP_ALLOCATIONS // 3} allocation tracebacks\n")
+                    for stat in snapshot.statistics('traceback')[:TOP_ALLOCATIONS // 3]:
+                        f.write(f"\n{stat.count} blocks, {stat.size / 1024:.1f} KiB\n")
+                        for line in stat.traceback.format():
+                            f.write(f"{line}\n")
+                kinds.append('alloc')
+
+            for kind in kinds:
+                self.storage.commit(self._file_path(profile_id, kind))
+            logger.info("Wrote profile %s for %s", profile_id, ctx['path'])
+        except Exception:
+            logger.exception("Failed to write profile %s", profile_id)
+
+    def init_app(self, app):
+        @app.before_request
+        def _profile_before_request():
+            self.start()
+
+        @app.after_request
+        def _profile_after_request(response):
+            return self.stop(response)
+
+        @app.teardown_request
+        def _profile_teardown_request(exc):
+            if 'profile' in g:
+                self.stop()
+
+        @app.route('/api/profiles/<profile_id>/<kind>', methods=['GET'])
+        def get_profile(profile_id, kind):
+            if not self.authorized(request.headers.get(PROFILE_HEADER)):
+                abort(404)
+            if kind not in PROFILE_FILES or not profile_id.isalnum():
+                abort(404)
+            path = self._file_path(profile_id, kind)
+            if not os.path.exists(path):
+                abort(404)
+            self.storage.touch(path)
+            return send_file(
+                os.path.abspath(path),
+                mimetype=PROFILE_FILES[kind][1],
+                as_attachment=True,
+                download_name=os.path.basename(path),
+            )
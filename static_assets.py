@@ -0,0 +1,212 @@
+"""Serving the built frontend (``New ui/dist``).
+
+``python static_assets.py compress [dist]`` writes ``.br`` and ``.gz``
+siblings next to every compressible file at build time; requests then get
+whichever variant their ``Accept-Encoding`` allows, without compressing
+anything per request. Vite puts content-hashed files under ``assets/``, so
+those are cached as immutable; ``index.html`` and other unhashed files are
+revalidated with an ETag on every load.
+
+With ``STATIC_OFFLOAD=x-accel-redirect`` (nginx) or ``x-sendfile``
+(Apache, lighttpd) the worker only picks the file and the front proxy sends
+it. Better still, let the proxy serve ``/assets/`` straight from the dist
+directory (nginx: ``gzip_static on; brotli_static on;``) so those requests
+never reach Python at all.
+"""
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import sys
+import threading
+
+from flask import abort, current_app, jsonify, request, send_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_EXTENSIONS = {'.html', '.js', '.mjs', '.css', '.json', '.map', '.svg', '.txt', '.xml', '.wasm', '.ico'}
+
+# Smaller files aren't worth the extra request headers and variant lookups.
+MIN_COMPRESS_BYTES = 1024
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Encoding name, file suffix; in order of preference.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+OFFLOAD_HEADERS = {'x-accel-redirect': 'X-Accel-Redirect', 'x-sendfile': 'X-Sendfile'}
+
+
+def _accepted_encodings(header):
+    accepted = set()
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if name:
+            accepted.add(name)
+    return accepted
+
+
+class StaticAssets:
+    """Serve a single-page app build with precompressed variants.
+
+    The dist directory doesn't change while the server runs, so the
+    variants and content-hash ETags of each file are looked up once and
+    cached.
+    """
+
+    def __init__(self, root, immutable_prefix='assets/', offload=None, offload_prefix='/_frontend/'):
+        self.root = os.path.abspath(root)
+        self.immutable_prefix = immutable_prefix
+        self.offload = (offload or '').lower() or None
+        if self.offload is not None and self.offload not in OFFLOAD_HEADERS:
+            raise ValueError(f"Unknown static offload mode {offload!r}. Choose from: {', '.join(OFFLOAD_HEADERS)}")
+        self.offload_prefix = offload_prefix
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def _resolve(self, rel_path):
+        path = os.path.abspath(os.path.join(self.root, rel_path))
+        if not path.startswith(self.root + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    @staticmethod
+    def _etag(path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                digest.update(chunk)
+        return digest.hexdigest()[:32]
+
+    def _entry(self, rel_path):
+        entry = self._files.get(rel_path)
+        if entry is not None:
+            return entry
+        path = self._resolve(rel_path)
+        if path is None:
+            return None
+        variants = {None: (path, self._etag(path))}
+        for encoding, suffix in ENCODINGS:
+            if os.path.isfile(path + suffix):
+                variants[encoding] = (path + suffix, self._etag(path + suffix))
+        entry = {
+            'mimetype': mimetypes.guess_type(path)[0] or 'application/octet-stream',
+            'variants': variants,
+        }
+        with self._lock:
+            self._files[rel_path] = entry
+        return entry
+
+    def _cache_control(self, rel_path):
+        if rel_path.startswith(self.immutable_prefix):
+            return f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+        return 'no-cache'
+
+    def serve(self, rel_path):
+        entry = self._entry(rel_path)
+        if entry is None:
+            return None
+
+        accepted = _accepted_encodings(request.headers.get('Accept-Encoding'))
+        encoding = next((name for name, _ in ENCODINGS if name in accepted and name in entry['variants']), None)
+        path, etag = entry['variants'][encoding]
+
+        if self.offload is not None:
+            response = self._offload_response(path, entry['mimetype'])
+            response.set_etag(etag)
+            # send_file does this itself; without it a revalidation would
+            # get the whole file from the proxy instead of a 304.
+            response = response.make_conditional(request)
+            if response.status_code == 304:
+                del response.headers[OFFLOAD_HEADERS[self.offload]]
+        else:
+            response = send_file(path, mimetype=entry['mimetype'], etag=etag,
+                                 download_name=os.path.basename(rel_path), conditional=True)
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        if len(entry['variants']) > 1:
+            response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = self._cache_control(rel_path)
+        return response
+
+    def _offload_response(self, path, mimetype):
+        response = current_app.response_class(mimetype=mimetype)
+        if self.offload == 'x-accel-redirect':
+            # An internal nginx location aliased to the dist directory.
+            target = self.offload_prefix + os.path.relpath(path, self.root).replace(os.sep, '/')
+        else:
+            target = path
+        response.headers[OFFLOAD_HEADERS[self.offload]] = target
+        return response
+
+    def init_app(self, app):
+        def frontend(path='index.html'):
+            if path.startswith('api/'):
+                return jsonify({'error': 'Not found.'}), 404
+            response = self.serve(path)
+            if response is None:
+                # Client-side routes (no file extension) get the app shell.
+                if os.path.splitext(path)[1]:
+                    abort(404)
+                response = self.serve('index.html')
+                if response is None:
+                    abort(404)
+            return response
+
+        app.add_url_rule('/', 'frontend_index', frontend, methods=['GET'])
+        app.add_url_rule('/<path:path>', 'frontend', frontend, methods=['GET'])
+
+
+def compress_tree(root, min_bytes=MIN_COMPRESS_BYTES):
+    """Write ``.gz`` (and ``.br`` if brotli is installed) next to each compressible file.
+
+    Variants that don't come out smaller than the original are skipped.
+    Returns the number of files written.
+    """
+    if brotli is None:
+        logger.warning("brotli is not installed; writing gzip variants only.")
+    written = 0
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            path = os.path.join(dirpath, name)
+            with open(path, 'rb') as f:
+                data = f.read()
+            if len(data) < min_bytes:
+                continue
+            variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                variants.append(('.br', brotli.compress(data, quality=11)))
+            for suffix, compressed in variants:
+                if len(compressed) >= len(data):
+                    continue
+                with open(path + suffix, 'wb') as f:
+                    f.write(compressed)
+                written += 1
+    return written
+
+
+if __name__ == '__main__':
+    # python static_assets.py compress [dist]
+    if len(sys.argv) >= 2 and sys.argv[1] == 'compress':
+        root = sys.argv[2] if len(sys.argv) > 2 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'New ui', 'dist')
+        logging.basicConfig(level=logging.INFO)
+        print(f"Wrote {compress_tree(root)} compressed files under {root}")
+    else:
+        print("usage: python static_assets.py compress [dist]")
+        sys.exit(2)
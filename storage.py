@@ -0,0 +1,182 @@
+import logging
+import os
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+JANITOR_LOCK_NAME = '.janitor.lock'
+
+# Extended attribute holding a file's expiry time (a Unix timestamp).
+EXPIRY_XATTR = 'user.benpdf.expires_at'
+
+
+class StorageManager:
+    """Disk storage with per-file TTLs and a size quota with LRU eviction.
+
+    State lives entirely in file metadata so every gunicorn worker sharing
+    the folder sees the same view: a file's expiry time is kept in an
+    extended attribute and its atime is its last access. The mtime is left
+    alone, so a file sent with ``send_file`` keeps a true Last-Modified.
+    Files without the attribute (unmanaged ones, or any file on a
+    filesystem without user xattrs) expire ``default_ttl`` seconds after
+    their mtime.
+    """
+
+    def __init__(self, root, default_ttl=3600, quota_bytes=1024 * 1024 * 1024,
+                 janitor_interval=300, min_age=30):
+        self.root = root
+        self.default_ttl = default_ttl
+        self.quota_bytes = quota_bytes
+        self.janitor_interval = janitor_interval
+        self.min_age = min_age
+        self._janitor_pid = None
+        self._janitor_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def _stamped_expiry(path):
+        try:
+            return float(os.getxattr(path, EXPIRY_XATTR))
+        except (AttributeError, OSError, ValueError):
+            return None
+
+    def _expires_at(self, path, mtime):
+        expires_at = self._stamped_expiry(path)
+        return mtime + self.default_ttl if expires_at is None else expires_at
+
+    def _stamp(self, path, ttl):
+        now = time.time()
+        ttl = self.default_ttl if ttl is None else ttl
+        st = os.stat(path)
+        expires_at = max(now + ttl, self._stamped_expiry(path) or 0)
+        try:
+            os.setxattr(path, EXPIRY_XATTR, repr(expires_at).encode('ascii'))
+        except (AttributeError, OSError) as e:
+            logger.debug("No expiry attribute on %s (%s); it expires %ss after its mtime", path, e, self.default_ttl)
+        os.utime(path, (now, st.st_mtime))
+
+    def new_path(self, suffix=''):
+        """Return a fresh managed path for callers that write the file themselves.
+
+        Call ``commit(path)`` once it is written so it gets its TTL.
+        """
+        return os.path.join(self.root, f"{uuid.uuid4().hex}{suffix}")
+
+    def commit(self, path, ttl=None):
+        self._stamp(path, ttl)
+        return path
+
+    def touch(self, path):
+        """Record an access for LRU purposes without changing the expiry."""
+        try:
+            st = os.stat(path)
+            os.utime(path, (time.time(), st.st_mtime))
+        except FileNotFoundError:
+            pass
+
+    def _entries(self):
+        entries = []
+        try:
+            with os.scandir(self.root) as it:
+                for entry in it:
+                    if entry.name.startswith('.') and not entry.name.startswith('.tmp-'):
+                        continue
+                    try:
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+                        st = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        continue
+                    expires_at = self._expires_at(entry.path, st.st_mtime)
+                    entries.append((entry.path, st.st_size, st.st_atime, expires_at))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.warning("Could not remove %s: %s", path, e)
+            return False
+
+    def sweep(self):
+        """Delete expired files, then evict least recently used ones until under quota."""
+        now = time.time()
+        expired = 0
+        evicted = 0
+        live = []
+        for path, size, atime, expires_at in self._entries():
+            if expires_at <= now:
+                if self._remove(path):
+                    expired += 1
+            else:
+                live.append((path, size, atime))
+
+        total = sum(size for _, size, _ in live)
+        if self.quota_bytes and total > self.quota_bytes:
+            live.sort(key=lambda e: e[2])
+            for path, size, atime in live:
+                if total <= self.quota_bytes:
+                    break
+                if now - atime < self.min_age:
+                    continue
+                if self._remove(path):
+                    total -= size
+                    evicted += 1
+
+        if expired or evicted:
+            logger.info("Storage sweep of %s: %d expired, %d evicted, %d bytes in use",
+                        self.root, expired, evicted, total)
+        return {'expired': expired, 'evicted': evicted, 'bytes': total}
+
+    def _sweep_exclusive(self):
+        """Sweep unless another worker holds the janitor lock."""
+        if fcntl is None:
+            return self.sweep()
+        lock_path = os.path.join(self.root, JANITOR_LOCK_NAME)
+        with open(lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return None
+            try:
+                return self.sweep()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _janitor_loop(self):
+        while True:
+            try:
+                self._sweep_exclusive()
+            except Exception:
+                logger.exception("Storage janitor failed for %s", self.root)
+            time.sleep(self.janitor_interval)
+
+    def ensure_janitor(self):
+        """Start the background janitor thread in this process if it is not running.
+
+        Safe to call on every request: threads do not survive a fork, so the
+        check is per pid.
+        """
+        pid = os.getpid()
+        if self._janitor_pid == pid:
+            return
+        with self._janitor_lock:
+            if self._janitor_pid == pid:
+                return
+            thread = threading.Thread(target=self._janitor_loop,
+                                      name=f"storage-janitor-{os.path.basename(self.root)}",
+                                      daemon=True)
+            thread.start()
+            self._janitor_pid = pid
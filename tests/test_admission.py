@@ -0,0 +1,116 @@
+import threading
+
+import pytest
+from flask import Flask
+
+import admission
+from admission import AdmissionController, CostClass, parse_classes, parse_endpoint_limits
+
+DEFAULTS = [CostClass('light', 0, 0, 0), CostClass('cpu', 4, 8, 2.0)]
+
+
+def test_parse_classes_overrides_defaults():
+    classes = {c.name: c for c in parse_classes('cpu=2:3:0.5, model=1', DEFAULTS)}
+    assert (classes['cpu'].capacity, classes['cpu'].max_queue, classes['cpu'].max_wait) == (2, 3, 0.5)
+    assert (classes['model'].capacity, classes['model'].max_queue) == (1, 0)
+    assert not classes['light'].limited
+
+
+def test_parse_classes_keeps_unspecified_fields():
+    classes = {c.name: c for c in parse_classes('cpu=::1.5', DEFAULTS)}
+    assert (classes['cpu'].capacity, classes['cpu'].max_queue, classes['cpu'].max_wait) == (4, 8, 1.5)
+
+
+def test_parse_endpoint_limits():
+    assert parse_endpoint_limits('a=1, b=3,') == {'a': 1, 'b': 3}
+    assert parse_endpoint_limits(None) == {}
+
+
+def _app(tmp_path, classes, endpoint_limits=None):
+    app = Flask(__name__)
+    controller = AdmissionController(classes, directory=str(tmp_path), endpoint_limits=endpoint_limits)
+    controller.init_app(app)
+    return app, controller
+
+
+def test_full_class_is_rejected_with_retry_after(tmp_path):
+    app, controller = _app(tmp_path, [CostClass('cpu', 1, 0, 1.0)])
+    started = threading.Event()
+    finish = threading.Event()
+
+    @app.route('/slow')
+    @controller.cost('cpu')
+    def slow():
+        started.set()
+        finish.wait(5)
+        return 'done'
+
+    @app.route('/fast')
+    def fast():
+        return 'ok'
+
+    client = app.test_client()
+    worker = threading.Thread(target=client.get, args=('/slow',))
+    worker.start()
+    try:
+        assert started.wait(5)
+        response = app.test_client().get('/slow')
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] == '1'
+        assert app.test_client().get('/fast').status_code == 200
+        assert controller.status()['cpu']['active'] == 1
+    finally:
+        finish.set()
+        worker.join()
+    assert controller.status()['cpu']['active'] == 0
+
+
+def test_endpoint_limit_applies_within_class(tmp_path):
+    app, controller = _app(tmp_path, [CostClass('cpu', 4, 0, 0)])
+    started = threading.Event()
+    finish = threading.Event()
+
+    @app.route('/limited')
+    @controller.cost('cpu', limit=1)
+    def limited():
+        started.set()
+        finish.wait(5)
+        return 'done'
+
+    @app.route('/other')
+    @controller.cost('cpu')
+    def other():
+        return 'ok'
+
+    worker = threading.Thread(target=app.test_client().get, args=('/limited',))
+    worker.start()
+    try:
+        assert started.wait(5)
+        assert app.test_client().get('/limited').status_code == 429
+        assert app.test_client().get('/other').status_code == 200
+        assert controller.endpoint_status() == {'limited': {'limit': 1, 'active': 1}}
+    finally:
+        finish.set()
+        worker.join()
+
+
+@pytest.mark.skipif(admission.fcntl is None, reason='file slots need fcntl')
+def test_in_use_does_not_take_slot_locks(tmp_path, monkeypatch):
+    slots = admission._FileSlots(str(tmp_path), 'cpu', 2)
+    held = slots.try_acquire(1)
+    calls = []
+    real_flock = admission.fcntl.flock
+    monkeypatch.setattr(admission.fcntl, 'flock', lambda *a: calls.append(a) or real_flock(*a))
+    assert slots.in_use() == 1
+    assert calls == []
+    slots.release(held)
+    assert slots.in_use() == 0
+
+
+@pytest.mark.skipif(admission.fcntl is None, reason='file slots need fcntl')
+def test_in_use_ignores_dead_holders(tmp_path):
+    slots = admission._FileSlots(str(tmp_path), 'cpu', 1)
+    with open(slots.paths[0], 'w') as f:
+        f.write('999999999')
+    assert slots.in_use() == 0
+    assert slots.try_acquire(1) is not None
@@ -0,0 +1,52 @@
+import io
+
+import pytest
+from PIL import Image
+
+import app as app_module
+
+
+@pytest.fixture
+def client():
+    return app_module.app.test_client()
+
+
+def test_resize_accepts_mpo_uploaded_as_jpg(client):
+    buf = io.BytesIO()
+    Image.new('RGB', (64, 48), 'red').save(buf, 'MPO', save_all=True, append_images=[Image.new('RGB', (64, 48))])
+    response = client.post('/api/resize-image', data={
+        'file': (io.BytesIO(buf.getvalue()), 'photo.jpg'), 'width': '32', 'height': '24',
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert Image.open(io.BytesIO(response.data)).size == (32, 24)
+
+
+def _png_bytes(size=(40, 30)):
+    buf = io.BytesIO()
+    Image.new('RGB', size).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+def test_probe_api_multipart(client):
+    response = client.post('/api/probe', data={'file': (io.BytesIO(_png_bytes()), 'a.png')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.get_json()['width'] == 40
+
+
+@pytest.mark.parametrize('content_type', ['application/octet-stream', 'application/x-www-form-urlencoded', None])
+def test_probe_api_raw_body(client, content_type):
+    response = client.post('/api/probe', data=_png_bytes(), content_type=content_type)
+    assert response.status_code == 200
+    assert response.get_json()['height'] == 30
+
+
+def test_probe_api_ico_route_rejects_other_formats(client):
+    buf = io.BytesIO()
+    Image.new('RGB', (8, 8)).save(buf, 'GIF')
+    response = client.post('/api/probe?route=ico', data=buf.getvalue(), content_type='application/octet-stream')
+    assert response.status_code == 415
+
+
+def test_probe_api_empty_body(client):
+    assert client.post('/api/probe', data=b'').status_code == 400
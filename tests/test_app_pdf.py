@@ -0,0 +1,94 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+import app as app_module
+
+pymupdf = pytest.importorskip('pymupdf')
+
+
+def _pdf(pages):
+    doc = pymupdf.open()
+    for i in range(pages):
+        doc.new_page().insert_text((72, 72), f'Page {i + 1}')
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+@pytest.fixture
+def client():
+    return app_module.app.test_client()
+
+
+def _converted():
+    return set(os.listdir(app_module.app.config['CONVERTED_FOLDER']))
+
+
+@pytest.mark.parametrize('route, data', [
+    ('/api/pdf/extract', lambda: {'file': (io.BytesIO(_pdf(5)), 'doc.pdf'), 'pages': '2-3'}),
+    ('/api/pdf/compress', lambda: {'file': (io.BytesIO(_pdf(3)), 'doc.pdf')}),
+    ('/api/pdf/merge', lambda: {'files': [(io.BytesIO(_pdf(2)), 'a.pdf'), (io.BytesIO(_pdf(1)), 'b.pdf')]}),
+])
+def test_pdf_outputs_are_removed_after_the_response(client, route, data):
+    before = _converted()
+    response = client.post(route, data=data(), content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.data.startswith(b'%PDF')
+    response.close()
+    assert _converted() == before
+
+
+def test_extract_rejects_out_of_range_pages(client):
+    before = _converted()
+    response = client.post('/api/pdf/extract', data={'file': (io.BytesIO(_pdf(2)), 'doc.pdf'), 'pages': '3'},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert _converted() == before
+
+
+def _split(client, **form):
+    before = _upload_files()
+    response = client.post('/api/pdf/split', data={'file': (io.BytesIO(_pdf(7)), 'doc.pdf'), **form},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/zip'
+    parts = {}
+    with zipfile.ZipFile(io.BytesIO(response.get_data())) as zf:
+        for name in zf.namelist():
+            with pymupdf.open(stream=zf.read(name), filetype='pdf') as doc:
+                parts[name] = [page.get_text().strip() for page in doc]
+    response.close()
+    assert _upload_files() == before
+    return parts
+
+
+def _upload_files():
+    return set(os.listdir(app_module.app.config['UPLOAD_FOLDER']))
+
+
+def test_split_by_page_ranges(client):
+    assert _split(client, pages='1-2,5,6-') == {
+        'doc_pages_1-2.pdf': ['Page 1', 'Page 2'],
+        'doc_pages_5.pdf': ['Page 5'],
+        'doc_pages_6-7.pdf': ['Page 6', 'Page 7'],
+    }
+
+
+def test_split_every_n_pages(client):
+    parts = _split(client, every='3')
+    assert list(parts) == ['doc_pages_1-3.pdf', 'doc_pages_4-6.pdf', 'doc_pages_7.pdf']
+    assert [len(pages) for pages in parts.values()] == [3, 3, 1]
+
+
+def test_split_defaults_to_single_pages(client):
+    assert len(_split(client)) == 7
+
+
+@pytest.mark.parametrize('form', [{'every': '0'}, {'every': 'x'}, {'pages': '9'}])
+def test_split_rejects_bad_ranges(client, form):
+    response = client.post('/api/pdf/split', data={'file': (io.BytesIO(_pdf(3)), 'doc.pdf'), **form},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
@@ -0,0 +1,82 @@
+import io
+import zipfile
+
+import anyio
+import httpx
+import pytest
+
+import asgi
+
+
+def _run(bridge, body_chunks, headers=()):
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(body_chunks) - 1}
+                for i, chunk in enumerate(body_chunks)]
+    received = []
+    sent = []
+
+    async def receive():
+        message = messages.pop(0)
+        received.append(message)
+        return message
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        'type': 'http', 'method': 'POST', 'path': '/api/probe', 'query_string': b'',
+        'headers': list(headers), 'http_version': '1.1',
+    }
+    anyio.run(bridge, scope, receive, send)
+    return sent, received
+
+
+def _bridge(limit):
+    bridge = asgi.AsgiBridge(asgi.wsgi_app)
+    bridge.wsgi = type('Wsgi', (), {'config': {'MAX_CONTENT_LENGTH': limit}})()
+    return bridge
+
+
+def test_declared_length_over_limit_is_refused_unread():
+    sent, received = _run(_bridge(1024), [b'x' * 512] * 4, headers=[(b'content-length', b'2048')])
+    assert sent[0]['status'] == 413
+    assert received == []
+
+
+def test_streamed_body_over_limit_stops_reading():
+    sent, received = _run(_bridge(1024), [b'x' * 512] * 8)
+    assert sent[0]['status'] == 413
+    assert len(received) == 3
+
+
+def _request(method, url, **kwargs):
+    async def go():
+        bridge = asgi.AsgiBridge(asgi.wsgi_app)
+        transport = httpx.ASGITransport(app=bridge)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+                return await client.request(method, url, **kwargs)
+        finally:
+            if bridge.client is not None:
+                await bridge.client.aclose()
+
+    return anyio.run(go)
+
+
+def test_plain_request_passes_through():
+    response = _request('GET', '/healthz')
+    assert response.status_code == 200
+    assert response.json()['status'] == 'ok'
+
+
+def test_streamed_response_is_sent_whole():
+    pymupdf = pytest.importorskip('pymupdf')
+    doc = pymupdf.open()
+    for i in range(3):
+        doc.new_page().insert_text((72, 72), f'Page {i + 1}')
+    pdf = doc.tobytes()
+    doc.close()
+
+    response = _request('POST', '/api/pdf/split', files={'file': ('doc.pdf', pdf, 'application/pdf')})
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.content)) as zf:
+        assert zf.namelist() == ['doc_pages_1.pdf', 'doc_pages_2.pdf', 'doc_pages_3.pdf']
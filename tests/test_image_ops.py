@@ -0,0 +1,91 @@
+import io
+
+import pytest
+from PIL import Image
+
+import image_ops
+
+
+def _encode(fmt, size=(800, 600), **kwargs):
+    buf = io.BytesIO()
+    Image.new('RGB', size, 'red').save(buf, fmt, **kwargs)
+    buf.seek(0)
+    return buf
+
+
+def _mpo(size=(800, 600)):
+    buf = io.BytesIO()
+    Image.new('RGB', size, 'red').save(buf, 'MPO', save_all=True, append_images=[Image.new('RGB', size, 'blue')])
+    buf.seek(0)
+    return buf
+
+
+def test_probe_reads_header_and_rewinds():
+    stream = _encode('PNG', size=(320, 200))
+    info = image_ops.probe(stream)
+    assert info['format'] == 'PNG'
+    assert (info['width'], info['height']) == (320, 200)
+    assert info['frames'] == 1
+    assert info['mode'] == 'RGB'
+    assert info['decoded_bytes'] == 320 * 200 * 4
+    assert stream.tell() == 0
+
+
+def test_probe_accepts_mpo_as_jpeg():
+    info = image_ops.probe(_mpo(), allowed_formats={'JPEG', 'PNG'})
+    assert info['format'] == 'MPO'
+    assert info['frames'] == 2
+
+
+def test_probe_rejects_unsupported_format():
+    with pytest.raises(image_ops.ProbeError) as excinfo:
+        image_ops.probe(_encode('BMP'), allowed_formats={'JPEG', 'PNG'})
+    assert excinfo.value.status == 415
+
+
+def test_probe_rejects_too_many_pixels():
+    with pytest.raises(image_ops.ProbeError) as excinfo:
+        image_ops.probe(_encode('PNG', size=(2000, 1000)), max_pixels=1_000_000)
+    assert excinfo.value.status == 413
+
+
+def test_probe_rejects_garbage():
+    with pytest.raises(image_ops.ProbeError) as excinfo:
+        image_ops.probe(io.BytesIO(b'not an image at all'))
+    assert excinfo.value.status == 400
+
+
+def test_probe_handles_truncated_upload():
+    data = _encode('JPEG', size=(4000, 3000)).getvalue()
+    info = image_ops.probe(io.BytesIO(data[:4096]))
+    assert (info['width'], info['height']) == (4000, 3000)
+
+
+def test_open_image_drafts_mpo_like_jpeg():
+    img = image_ops.open_image(_mpo(size=(1600, 1200)), target_size=(200, 150))
+    assert img.size == (200, 150)
+
+
+def test_open_image_rejects_over_budget_before_decoding():
+    with pytest.raises(image_ops.MemoryBudgetError):
+        image_ops.open_image(_encode('PNG', size=(1000, 1000)), budget=1_000_000)
+
+
+class _FakeRembg:
+    def __init__(self):
+        self.seen = []
+
+    def remove(self, img, session=None, only_mask=False):
+        self.seen.append(img.size)
+        return Image.new('L', img.size, 255)
+
+
+def test_remove_background_lowres_runs_model_on_small_image(monkeypatch):
+    img = Image.new('RGB', (4000, 2000), 'red')
+    copies = []
+    monkeypatch.setattr(Image.Image, 'copy', lambda self: copies.append(self.size) or self._new(self.im.copy()))
+    rembg = _FakeRembg()
+    out = image_ops.remove_background(img, rembg, session=None, inference='lowres', input_size=320)
+    assert rembg.seen == [(320, 160)]
+    assert (4000, 2000) not in copies
+    assert out.size == (4000, 2000) and out.mode == 'RGBA'
@@ -0,0 +1,50 @@
+import json
+import os
+
+from metrics import Metrics, RETIRED_NAME
+
+DEAD_PID = 999999999
+
+
+def _write_worker_file(directory, pid, requests, in_flight=0):
+    data = {
+        'requests': {'/x\x1fGET\x1f200': requests},
+        'latency': {'/x': {'buckets': [requests] + [0] * 12, 'sum': 0.001 * requests, 'count': requests}},
+        'stages': {}, 'bytes_in': {'/x': 10 * requests}, 'bytes_out': {},
+        'in_flight': {'/x': in_flight},
+    }
+    with open(os.path.join(directory, f'metrics-{pid}.json'), 'w') as f:
+        json.dump(data, f)
+
+
+def test_collect_folds_dead_workers_into_retired_file(tmp_path):
+    _write_worker_file(tmp_path, DEAD_PID, 3, in_flight=2)
+    _write_worker_file(tmp_path, DEAD_PID - 1, 4)
+    metrics = Metrics(metrics_dir=str(tmp_path))
+    merged = metrics.collect()
+    assert merged['requests']['/x\x1fGET\x1f200'] == 7
+    assert merged['latency']['/x']['count'] == 7
+    assert merged['bytes_in']['/x'] == 70
+    assert merged['in_flight'].get('/x', 0) == 0
+    names = sorted(os.listdir(tmp_path))
+    assert RETIRED_NAME in names
+    assert f'metrics-{DEAD_PID}.json' not in names and f'metrics-{DEAD_PID - 1}.json' not in names
+
+    _write_worker_file(tmp_path, DEAD_PID, 1)
+    assert metrics.collect()['requests']['/x\x1fGET\x1f200'] == 8
+
+
+def test_reused_pid_does_not_overwrite_previous_counts(tmp_path):
+    _write_worker_file(tmp_path, os.getpid(), 5)
+    metrics = Metrics(metrics_dir=str(tmp_path))
+    metrics.request_finished('/x', 'GET', 200, 0.01, 0, 0)
+    assert metrics.collect()['requests']['/x\x1fGET\x1f200'] == 6
+    assert metrics.collect()['requests']['/x\x1fGET\x1f200'] == 6
+
+
+def test_reset_removes_retired_counts(tmp_path):
+    _write_worker_file(tmp_path, DEAD_PID, 3)
+    metrics = Metrics(metrics_dir=str(tmp_path))
+    metrics.prune()
+    metrics.reset()
+    assert metrics.collect()['requests'] == {}
@@ -0,0 +1,38 @@
+import io
+import zipfile
+
+import pytest
+
+from pdf_ops import PdfError, chunk_ranges, parse_page_ranges, stream_zip
+
+
+@pytest.mark.parametrize('spec, expected', [
+    ('1', [(0, 0)]),
+    ('1-3,5', [(0, 2), (4, 4)]),
+    (' 2 - 4 , 8- ', [(1, 3), (7, 9)]),
+    ('-3', [(0, 2)]),
+    ('5,1', [(4, 4), (0, 0)]),
+    ('1-1', [(0, 0)]),
+    ('1,,2', [(0, 0), (1, 1)]),
+])
+def test_parse_page_ranges(spec, expected):
+    assert parse_page_ranges(spec, 10) == expected
+
+
+@pytest.mark.parametrize('spec', ['', ' , ', None, '-', 'a', '1-2-3', '0', '11', '4-2', '3-11'])
+def test_parse_page_ranges_rejects(spec):
+    with pytest.raises(PdfError):
+        parse_page_ranges(spec, 10)
+
+
+def test_chunk_ranges_covers_the_document():
+    assert chunk_ranges(7, 3) == [(0, 2), (3, 5), (6, 6)]
+    assert chunk_ranges(3, 5) == [(0, 2)]
+
+
+def test_stream_zip_yields_a_valid_archive():
+    members = [('a.txt', b'first'), ('b.txt', b'second' * 1000)]
+    archive = b''.join(stream_zip(iter(members)))
+    with zipfile.ZipFile(io.BytesIO(archive)) as zf:
+        assert zf.namelist() == ['a.txt', 'b.txt']
+        assert zf.read('b.txt') == b'second' * 1000
@@ -0,0 +1,55 @@
+import pytest
+from PIL import Image
+
+from image_ops import MAX_PIPELINE_STEPS, PipelineError, parse_pipeline, pipeline_footprint, run_pipeline
+
+
+def test_parse_pipeline_normalizes_steps_and_output():
+    steps, output = parse_pipeline([
+        {'op': 'remove_background', 'inference': 'LOWRES', 'tier': ' Fast '},
+        {'op': 'resize', 'width': '64', 'height': 32},
+        {'op': 'encode', 'format': '.WEBP', 'quality': 80},
+    ])
+    assert steps == [
+        {'op': 'remove_background', 'tier': 'fast', 'inference': 'lowres', 'mask_only': False},
+        {'op': 'resize', 'width': 64, 'height': 32},
+    ]
+    assert output == {'format': 'webp', 'compression': 6, 'quality': 80}
+
+
+def test_parse_pipeline_defaults_to_png():
+    steps, output = parse_pipeline([{'op': 'resize', 'width': 10, 'height': 10}])
+    assert output == {'format': 'png', 'compression': 6, 'quality': None}
+
+
+@pytest.mark.parametrize('operations', [
+    [],
+    {'op': 'resize'},
+    [{'op': 'rotate'}],
+    ['resize'],
+    [{'op': 'encode'}, {'op': 'resize', 'width': 1, 'height': 1}],
+    [{'op': 'encode', 'format': 'tiff'}],
+    [{'op': 'encode', 'compression': 10}],
+    [{'op': 'resize', 'width': 10}],
+    [{'op': 'resize', 'width': 0, 'height': 10}],
+    [{'op': 'resize', 'width': 9000, 'height': 10}],
+    [{'op': 'resize', 'width': 'wide', 'height': 10}],
+    [{'op': 'remove_background', 'inference': 'fastest'}],
+    [{'op': 'remove_background', 'output': 'alpha'}],
+    [{'op': 'resize', 'width': 1, 'height': 1}] * (MAX_PIPELINE_STEPS + 1),
+])
+def test_parse_pipeline_rejects(operations):
+    with pytest.raises(PipelineError):
+        parse_pipeline(operations)
+
+
+def test_footprint_decodes_at_reduced_size_only_when_resizing_first():
+    steps, output = parse_pipeline([{'op': 'resize', 'width': 100, 'height': 50}])
+    assert pipeline_footprint(steps, output)['target_size'] == (100, 50)
+    steps, output = parse_pipeline([{'op': 'remove_background'}, {'op': 'resize', 'width': 100, 'height': 50}])
+    assert pipeline_footprint(steps, output)['target_size'] is None
+
+
+def test_run_pipeline_resizes():
+    steps, _ = parse_pipeline([{'op': 'resize', 'width': 20, 'height': 10}])
+    assert run_pipeline(Image.new('RGB', (200, 100)), steps).size == (20, 10)
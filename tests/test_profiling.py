@@ -0,0 +1,66 @@
+import io
+import os
+import time
+
+import pytest
+from PIL import Image
+
+import app as app_module
+from storage import StorageManager
+
+TOKEN = 'test-profile-token'
+
+
+@pytest.fixture
+def profiler(tmp_path, monkeypatch):
+    profiler = app_module.profiler
+    monkeypatch.setattr(profiler, 'token', TOKEN)
+    monkeypatch.setattr(profiler, 'sample_rate', 0.0)
+    monkeypatch.setattr(profiler, 'storage', StorageManager(str(tmp_path)))
+    return profiler
+
+
+def _wait_for_files(tmp_path, profile_id, suffixes, timeout=10):
+    expected = {f'{profile_id}.{suffix}' for suffix in suffixes}
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if expected <= set(os.listdir(tmp_path)):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def _png():
+    buf = io.BytesIO()
+    Image.new('RGB', (64, 48), 'red').save(buf, 'PNG')
+    buf.seek(0)
+    return buf
+
+
+def test_profile_is_written_for_send_file_routes(profiler, tmp_path):
+    client = app_module.app.test_client()
+    response = client.post('/api/resize-image', data={'file': (_png(), 'a.png'), 'width': '32', 'height': '24'},
+                           content_type='multipart/form-data', headers={'X-Profile': TOKEN})
+    assert response.status_code == 200
+    profile_id = response.headers['X-Profile-Id']
+    assert _wait_for_files(tmp_path, profile_id, ('prof', 'folded', 'alloc'))
+
+    fetched = client.get(f'/api/profiles/{profile_id}/folded', headers={'X-Profile': TOKEN})
+    assert fetched.status_code == 200
+    assert b'resize_image_api' in fetched.data
+
+
+def test_sampled_profile_skips_allocations(profiler, tmp_path, monkeypatch):
+    monkeypatch.setattr(profiler, 'sample_rate', 1.0)
+    response = app_module.app.test_client().get('/healthz')
+    profile_id = response.headers['X-Profile-Id']
+    assert _wait_for_files(tmp_path, profile_id, ('prof', 'folded'))
+    time.sleep(0.1)
+    assert not os.path.exists(tmp_path / f'{profile_id}.alloc')
+
+
+def test_wrong_token_is_not_profiled(profiler):
+    response = app_module.app.test_client().get('/healthz', headers={'X-Profile': 'nope'})
+    assert 'X-Profile-Id' not in response.headers
+    response = app_module.app.test_client().get(f'/healthz?__profile={TOKEN}')
+    assert 'X-Profile-Id' not in response.headers
@@ -0,0 +1,56 @@
+import pytest
+from flask import Flask
+
+from static_assets import StaticAssets, _accepted_encodings
+
+
+def test_accepted_encodings_parses_names_and_q_values():
+    assert _accepted_encodings('gzip, deflate, br') == {'gzip', 'deflate', 'br'}
+    assert _accepted_encodings('br;q=0, gzip;q=0.5') == {'gzip'}
+    assert _accepted_encodings('BR ; q=1.0') == {'br'}
+    assert _accepted_encodings('gzip;q=bogus, br') == {'br'}
+    assert _accepted_encodings(None) == set()
+
+
+@pytest.fixture
+def dist(tmp_path):
+    (tmp_path / 'index.html').write_text('<html>app</html>')
+    (tmp_path / 'assets').mkdir()
+    (tmp_path / 'assets' / 'app.1234.js').write_text('console.log(1)' * 10)
+    (tmp_path / 'assets' / 'app.1234.js.gz').write_bytes(b'gz-variant')
+    return tmp_path
+
+
+def _client(dist, **kwargs):
+    app = Flask(__name__)
+    StaticAssets(str(dist), **kwargs).init_app(app)
+    return app.test_client()
+
+
+def test_serves_precompressed_variant_with_immutable_caching(dist):
+    response = _client(dist).get('/assets/app.1234.js', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.data == b'gz-variant'
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'Accept-Encoding' in response.headers['Vary']
+
+
+def test_client_routes_get_the_app_shell(dist):
+    response = _client(dist).get('/some/route')
+    assert response.data == b'<html>app</html>'
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+
+@pytest.mark.parametrize('offload', [None, 'x-accel-redirect'])
+def test_revalidation_returns_304(dist, offload):
+    client = _client(dist, offload=offload)
+    etag = client.get('/index.html').headers['ETag']
+    response = client.get('/index.html', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert 'X-Accel-Redirect' not in response.headers
+
+
+def test_offload_names_the_file_for_the_proxy(dist):
+    response = _client(dist, offload='x-accel-redirect').get('/assets/app.1234.js')
+    assert response.headers['X-Accel-Redirect'] == '/_frontend/assets/app.1234.js'
+    assert response.data == b''
@@ -0,0 +1,77 @@
+import os
+import time
+
+from storage import StorageManager
+
+
+def _write(storage, size, suffix='.bin'):
+    path = storage.new_path(suffix)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    return path
+
+
+def _age(path, seconds):
+    st = os.stat(path)
+    os.utime(path, (st.st_atime - seconds, st.st_mtime - seconds))
+
+
+def test_commit_keeps_mtime(tmp_path):
+    storage = StorageManager(str(tmp_path), default_ttl=3600)
+    path = _write(storage, 10)
+    before = os.stat(path).st_mtime
+    storage.commit(path)
+    assert os.stat(path).st_mtime == before
+    assert os.stat(path).st_mtime <= time.time()
+
+
+def test_sweep_removes_expired_files(tmp_path):
+    storage = StorageManager(str(tmp_path), default_ttl=3600, quota_bytes=0)
+    expired = storage.commit(_write(storage, 10), ttl=-1)
+    live = storage.commit(_write(storage, 10))
+    result = storage.sweep()
+    assert result['expired'] == 1
+    assert not os.path.exists(expired)
+    assert os.path.exists(live)
+
+
+def test_sweep_expires_unmanaged_files_by_mtime(tmp_path):
+    storage = StorageManager(str(tmp_path), default_ttl=60, quota_bytes=0)
+    old = tmp_path / 'leftover.pdf'
+    old.write_bytes(b'x')
+    _age(str(old), 120)
+    recent = tmp_path / 'recent.pdf'
+    recent.write_bytes(b'x')
+    storage.sweep()
+    assert not old.exists()
+    assert recent.exists()
+
+
+def test_commit_never_shortens_expiry(tmp_path):
+    storage = StorageManager(str(tmp_path), default_ttl=3600, quota_bytes=0)
+    path = storage.commit(_write(storage, 10), ttl=7200)
+    storage.commit(path, ttl=-1)
+    assert storage.sweep()['expired'] == 0
+    assert os.path.exists(path)
+
+
+def test_sweep_evicts_least_recently_used_over_quota(tmp_path):
+    storage = StorageManager(str(tmp_path), default_ttl=3600, quota_bytes=250, min_age=30)
+    oldest = storage.commit(_write(storage, 100))
+    middle = storage.commit(_write(storage, 100))
+    newest = storage.commit(_write(storage, 100))
+    _age(oldest, 300)
+    _age(middle, 200)
+    storage.touch(middle)
+    _age(newest, 100)
+    result = storage.sweep()
+    assert result == {'expired': 0, 'evicted': 1, 'bytes': 200}
+    assert not os.path.exists(oldest)
+    assert os.path.exists(middle) and os.path.exists(newest)
+
+
+def test_sweep_spares_files_younger_than_min_age(tmp_path):
+    storage = StorageManager(str(tmp_path), default_ttl=3600, quota_bytes=50, min_age=30)
+    path = storage.commit(_write(storage, 100))
+    assert storage.sweep()['evicted'] == 0
+    assert os.path.exists(path)
@@ -0,0 +1,156 @@
+import importlib
+import importlib.util
+import logging
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+from metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+
+def current_rss_bytes():
+    """Resident set size of this process, or 0 where it can't be read."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        # ru_maxrss is the peak, in KiB on Linux and bytes on macOS.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        return 0
+
+
+class Tool:
+    def __init__(self, name, modules, loader, stage='import'):
+        self.name = name
+        self.modules = modules
+        self.loader = loader
+        self.stage = stage
+        self.value = None
+        self.loaded = False
+        self.load_seconds = None
+        self.rss_delta = None
+        self._available = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        """True if every module the tool needs can be found, without importing it."""
+        if self._available is None:
+            try:
+                self._available = all(importlib.util.find_spec(m) is not None for m in self.modules)
+            except (ImportError, ValueError):
+                self._available = False
+        return self._available
+
+    def load(self):
+        if self.loaded:
+            return self.value
+        with self._lock:
+            if self.loaded:
+                return self.value
+            rss_before = current_rss_bytes()
+            start = time.perf_counter()
+            with stage_timer(self.stage):
+                self.value = self.loader()
+            self.load_seconds = time.perf_counter() - start
+            self.rss_delta = current_rss_bytes() - rss_before
+            self.loaded = True
+            logger.info("Loaded tool %s in %.3fs (+%d KiB RSS)", self.name, self.load_seconds, self.rss_delta // 1024)
+            return self.value
+
+
+class ToolRegistry:
+    """Heavy optional dependencies, imported on first use.
+
+    Handlers call ``tool_registry.load(name)`` instead of importing at module
+    level, so a worker only pays for the tools it actually serves.
+    """
+
+    def __init__(self):
+        self.tools = {}
+
+    def register(self, name, modules, stage='import'):
+        def decorator(loader):
+            self.tools[name] = Tool(name, modules, loader, stage=stage)
+            return loader
+        return decorator
+
+    def available(self, name):
+        return self.tools[name].available
+
+    def load(self, name):
+        tool = self.tools[name]
+        if not tool.available:
+            raise ImportError(f"Tool '{name}' is not installed (needs {', '.join(tool.modules)})")
+        return tool.load()
+
+    def status(self):
+        return {
+            name: {
+                'available': tool.available,
+                'loaded': tool.loaded,
+                'load_seconds': tool.load_seconds,
+                'rss_delta_bytes': tool.rss_delta,
+            }
+            for name, tool in self.tools.items()
+        }
+
+
+tool_registry = ToolRegistry()
+
+
+@tool_registry.register('sympy', ['sympy'])
+def _load_sympy():
+    import sympy
+    from sympy.core.add import Add
+    from sympy.core.mul import Mul
+    from sympy.parsing.sympy_parser import (
+        standard_transformations, implicit_multiplication_application, convert_xor, parse_expr,
+    )
+    return SimpleNamespace(
+        symbols=sympy.symbols, diff=sympy.diff, integrate=sympy.integrate, latex=sympy.latex,
+        expand=sympy.expand, Symbol=sympy.Symbol,
+        sin=sympy.sin, cos=sympy.cos, tan=sympy.tan, asin=sympy.asin, acos=sympy.acos, atan=sympy.atan,
+        log=sympy.log, exp=sympy.exp, sqrt=sympy.sqrt, pi=sympy.pi, E=sympy.E, Abs=sympy.Abs,
+        Add=Add, Mul=Mul,
+        parse_expr=parse_expr,
+        transformations=standard_transformations + (implicit_multiplication_application,) + (convert_xor,),
+    )
+
+
+@tool_registry.register('pdf2docx', ['pdf2docx'])
+def _load_pdf2docx():
+    from pdf2docx import Converter
+    return Converter
+
+
+@tool_registry.register('pymupdf', ['pymupdf'])
+def _load_pymupdf():
+    import pymupdf
+    return pymupdf
+
+
+@tool_registry.register('qrcode', ['qrcode'])
+def _load_qrcode():
+    import qrcode
+    import qrcode.constants
+    return qrcode
+
+
+@tool_registry.register('requests', ['requests'])
+def _load_requests():
+    import requests
+    return requests
+
+
+@tool_registry.register('rembg', ['rembg', 'onnxruntime'], stage='model-load')
+def _load_rembg():
+    import rembg
+    return rembg